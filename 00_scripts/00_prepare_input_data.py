@@ -13,12 +13,14 @@ for x in [
 import functions.folders as folders
 import functions.station_cls as station_cls
 import functions.irc_settings as irc_settings
+import functions.prepare_parallel as prepare_parallel
 
 import importlib
 
 importlib.reload(folders)
 importlib.reload(station_cls)  # Reload folders to skip kernel reload.
 importlib.reload(irc_settings)
+importlib.reload(prepare_parallel)
 import os
 
 
@@ -26,29 +28,55 @@ folder = folders.Folders(os.pardir)  # create folder structure from parent dir.
 
 settings_all = irc_settings.IrcSettings(folder=folder)
 
+# Resample all organisations and wiwb at the same time in a process pool. The
+# gpkg is updated afterwards by this process.
+PARALLEL = True
+MAX_WORKERS = None  # None uses all cores.
+# Only resample raw data after the last resampled timestep (e.g. when a new month is added).
+INCREMENTAL = False
+
 
 # %%
-# Resample data
+# Resample data in parallel (station and wiwb)
+if PARALLEL and __name__ == "__main__":
+    durations = prepare_parallel.prepare_all(
+        folder=folder,
+        settings_all=settings_all,
+        max_workers=MAX_WORKERS,
+        overwrite=True,
+        incremental=INCREMENTAL,
+    )
+
+
+# %%
+# Resample data sequentially
+# The __main__ guard is needed because HEA is loaded in a process pool, whose
+# workers import this script again (spawn on Windows).
 
 # Station
-for organisation in settings_all.org:
+if not PARALLEL and __name__ == "__main__":
+    for organisation in settings_all.org:
 
-# for organisation in ["WAM"]:
-    stations_organisation = station_cls.Stations_organisation(
-        folder=folder,
-        organisation=organisation,
-        settings=settings_all.org[organisation],
-    )
+    # for organisation in ["WAM"]:
+        stations_organisation = station_cls.Stations_organisation(
+            folder=folder,
+            organisation=organisation,
+            settings=settings_all.org[organisation],
+            resample_rules=settings_all.resample_rules,
+        )
 
-    # Resample timeseries to hour and day values.
-    locations = stations_organisation.resample(overwrite=True)
+        # Resample timeseries to hour and day values.
+        locations = stations_organisation.resample(overwrite=True, incremental=INCREMENTAL)
 
-    # Add locations from xml to the gpkg
-    stations_organisation.add_locations_to_gpkg(locations)
+        # Add locations from xml to the gpkg
+        stations_organisation.add_locations_to_gpkg(locations)
 
 # %%
 # Wiwb
-wiwb_combined = station_cls.Wiwb_combined(folder=folder, settings=settings_all.wiwb)
-wiwb_combined.resample(overwrite=True)
+if not PARALLEL and __name__ == "__main__":
+    wiwb_combined = station_cls.Wiwb_combined(
+        folder=folder, settings=settings_all.wiwb, resample_rules=settings_all.resample_rules
+    )
+    wiwb_combined.resample(overwrite=True, incremental=INCREMENTAL)
 
 
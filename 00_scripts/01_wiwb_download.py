@@ -12,6 +12,11 @@ for x in [
         print(f"not in path: {x}")
 
 import functions.wiwb as wiwb
+import functions.wiwb_scheduler as wiwb_scheduler
+import functions.wiwb_manifest as wiwb_manifest
+import functions.wiwb_planner as wiwb_planner
+import functions.wiwb_local as wiwb_local
+import functions.irc_cube as irc_cube
 import pandas as pd
 import plotly.express as px
 import geopandas as gpd
@@ -56,46 +61,121 @@ MAX_END_DATE = {
 ORGANISATIONS = ["HHNK", "HDSR", "WL", "HEA", "WF", "WAM"]
 ORGANISATIONS = ["WAM"]
 
+# Download settings. The wiwb is one host, so MAX_PER_HOST limits the number
+# of simultaneous requests to the wiwb.
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+MAX_RETRIES = 3
+USE_LOCAL_DOWNLOADER = False  # True to test with generated data (functions/wiwb_local.py)
+WRITE_CUBE = True  # Also save the full grids, see station_cls.Wiwb_combined(source="cube")
+WRITE_COMBINED = False  # Also write a single file per organisation and source, e.g. to share the data
+
 # %%
+# Only windows that are missing, failed or not yet final in the manifest are downloaded.
+manifest = wiwb_manifest.ChunkManifest("../01_data/p_raw_wiwb")
 
+points = {}
+extent_hashes = {}
 for organisation in ORGANISATIONS:
     locs_organisation = locs[locs["organisation"] == organisation]
-    points, extent = wiwb.get_points_from_gdf(locs_organisation)
+    points[organisation], extent = wiwb.get_points_from_gdf(locs_organisation)
+    extent_hashes[organisation] = wiwb_manifest.extent_hash(extent, points[organisation])
+
+cubes = {data_source: irc_cube.IrcCube("../01_data/p_cube_wiwb", data_source) for data_source in DATA_SOURCES}
+
+# Merge overlapping extents, so every grid cell and window is downloaded once.
+groups = {group.name: group for group in wiwb_planner.plan_downloads(points)}
+for group in groups.values():
+    print(f"Download group {group}")
 
-    df_wiwb_all = {}
+jobs = []
+for group in groups.values():
     for data_source in DATA_SOURCES:
-        output_path = f"../01_data/p_raw_wiwb/{organisation}_{data_source}_raw_{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}.parquet"
-        if not os.path.exists(output_path):
-            print(f"Starting {organisation} - {data_source}")
-            current = start_date
-            df_wiwb = pd.Series(dtype="float64")
-
-            while current < end_date:
-                end = current + datetime.timedelta(days=10)
-                if end < MAX_END_DATE[data_source]:
-                    print(f"    downloading from {current} to {end}", end="\r")
-
-                    try:
-                        df_temp = wiwb.download_wiwb(
-                            data_source=DATA_SOURCES[data_source],
-                            points=points,
-                            start=current,
-                            end=end,
-                            extent=extent,
-                        )
-                    except:
-                        continue
-
-                    if df_wiwb.empty:
-                        df_wiwb = df_temp.copy()
-                    else:
-                        df_wiwb = df_wiwb.append(df_temp)
-
-                current = end
-
-            df_wiwb_all[data_source] = df_wiwb.copy()
-
-            pd.DataFrame(df_wiwb_all[data_source]).to_parquet(output_path)
+        # Window is downloaded when it is pending for any organisation in the group.
+        pending = {}
+        for organisation in group.organisations:
+            for start, end, final in manifest.pending(
+                organisation=organisation,
+                data_source=data_source,
+                extent_hash=extent_hashes[organisation],
+                start_date=start_date,
+                end_date=end_date,
+                max_end_date=MAX_END_DATE[data_source],
+            ):
+                pending[start] = (end, final)
+
+        for start, (end, final) in sorted(pending.items()):
+            jobs.append(wiwb_scheduler.DownloadJob(group.name, data_source, start, end, final=final))
+
+
+def download_job(job):
+    """Download a window of a group and save it as partition per organisation.
+    Returns the number of rows per organisation."""
+    group = groups[job.group]
+    point_series = wiwb.download_wiwb(
+        data_source=DATA_SOURCES[job.data_source],
+        points=group.points,
+        start=job.start,
+        end=job.end,
+        extent=group.extent,
+        downloader_cls=wiwb_local.LocalGridDownloader if USE_LOCAL_DOWNLOADER else None,
+        cube=cubes[job.data_source] if WRITE_CUBE else None,
+        return_series=False,
+    )
+    rows = {}
+    for organisation, df_organisation in group.split(point_series).items():
+        partition_path = manifest.partition_path(organisation, job.data_source, job.start)
+        partition_path.parent.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(df_organisation).to_parquet(partition_path)
+        rows[organisation] = len(df_organisation)
+    return rows
+
+
+scheduler = wiwb_scheduler.DownloadScheduler(
+    download_func=download_job,
+    max_workers=MAX_WORKERS,
+    max_per_host=MAX_PER_HOST,
+    max_retries=MAX_RETRIES,
+    no_data=(wiwb.NoDataError,),
+)
+jobs = scheduler.run(jobs)
+
+for job in jobs:
+    # Windows without data are complete (rows=0), only failed downloads are retried.
+    if job.status in ("done", "empty"):
+        status = wiwb_manifest.STATUS_FINAL if job.final else wiwb_manifest.STATUS_PARTIAL
+    else:
+        status = wiwb_manifest.STATUS_FAILED
+    for organisation in groups[job.group].organisations:
+        manifest.record(
+            organisation=organisation,
+            data_source=job.data_source,
+            extent_hash=extent_hashes[organisation],
+            start=job.start,
+            status=status,
+            rows=job.result[organisation] if job.status == "done" else 0,
+        )
+manifest.save()
+
+# Report windows that could not be downloaded, they are retried on the next run.
+failure_report = scheduler.failure_report(jobs)
+if not failure_report.empty:
+    print(failure_report.to_string())
+    failure_report.to_csv("../01_data/p_raw_wiwb/failed_windows.csv", index=False)
+
+# %%
+# The partitions are read directly by station_cls.Wiwb_combined (see irc_settings).
+# Optionally combine them into one file per organisation and data source.
+if WRITE_COMBINED:
+    for organisation in ORGANISATIONS:
+        for data_source in DATA_SOURCES:
+            rows = manifest.consolidate(
+                organisation=organisation,
+                data_source=data_source,
+                extent_hash=extent_hashes[organisation],
+                output_path=f"../01_data/p_raw_wiwb/{organisation}_{data_source}_raw.parquet",
+            )
+            print(f"{organisation} - {data_source}: {rows} rows")
 print("DONE")
 
 # %%
@@ -59,7 +59,8 @@ gdf = station_cls.Stations_combined(
 gdf.set_index("ID", inplace=True)
 
 
-stations_stats = {}
+stations_combined_rules = {}
+stats_all = []
 for resample_rule in ["d", "h"]:
 
     # Initialize stations
@@ -73,43 +74,31 @@ for resample_rule in ["d", "h"]:
         resample_rule=resample_rule,
         settings_all=settings_all,
     )
-    stations_combined.load_stations()
-    stations_combined.load_wiwb()
-
-    # Calculate statistics per station.
-    stations_stats[resample_rule] = {}
-    for station in stations_combined:
-        print(station.code)
-        # if station.code == "MPN-AS-2014": #Testen met 1 station.
-        stations_stats[resample_rule][station.code] = station_statistics.StationStats(
-            station
-        )
+    stations_combined_rules[resample_rule] = stations_combined
+
+    # Calculate statistics of all stations at once.
+    cube = stations_combined.build_cube()
+    for message in cube.attrs["missing"]:
+        print(message)
+    stats_rule = station_statistics.network_stats(cube)
+    stats_rule["resample_rule"] = resample_rule
+    stats_all.append(stats_rule)
+stats_all = pd.concat(stats_all, ignore_index=True)
 
 
 # %%
 # Combine statistics of all stations in geodataframe
 
-for resample_rule in ["d", "h"]:
-    for code in stations_stats[resample_rule]:
-        station_stats = stations_stats[resample_rule][code]
-
-        for irc_type in station_stats.station.irc_types:
-            gdf.at[code, f"bias_{irc_type}_{resample_rule}"] = station_stats.irc_stats[
-                irc_type
-            ].RelBiasTotal
-            gdf.at[code, f"stdev_{irc_type}_{resample_rule}"] = station_stats.irc_stats[
-                irc_type
-            ].stdev
-            if irc_type == "irc_final":
-                gdf.at[
-                    code, f"bias_cumu_{irc_type}_{resample_rule}"
-                ] = station_stats.irc_stats[irc_type].RelBiasTotalCumu
-
-            gdf.loc[code, f"stdev_{irc_type}_{resample_rule}"] = station_stats.irc_stats[irc_type].stdev
-            # gdf.loc[code, f"stat_corr_{irc_type}"] = station_stats.irc_stats[irc_type].corr
-
-    # Save to file
-    gdf.to_file(f"../01_data/ground_stations_stats.gpkg", driver="GPKG")
+for (irc_type, resample_rule), stats_irc in stats_all.groupby(["irc_type", "resample_rule"]):
+    stats_irc = stats_irc.set_index("ID")
+    gdf[f"bias_{irc_type}_{resample_rule}"] = stats_irc["RelBiasTotal"]
+    gdf[f"stdev_{irc_type}_{resample_rule}"] = stats_irc["stdev"]
+    if irc_type == "irc_final":
+        gdf[f"bias_cumu_{irc_type}_{resample_rule}"] = stats_irc["RelBiasTotalCumu"]
+    # gdf[f"stat_corr_{irc_type}"] = stats_irc["corr"]
+
+# Save to file
+gdf.to_file(f"../01_data/ground_stations_stats.gpkg", driver="GPKG")
 
 # %%
 from matplotlib.gridspec import GridSpec
@@ -119,15 +108,26 @@ fig = plt.figure(figsize=(11, 16), facecolor='white')
 gs = GridSpec(5, 2, figure=fig)
 
 
-for code in stations_stats[resample_rule]:
+for code in stats_all["ID"].unique():
+    # A station can be missing from the cube of one resample rule.
+    if not all(code in sc.cube.stations for sc in stations_combined_rules.values()):
+        print(f"{code} skipped, not available for every resample rule")
+        continue
     print(code)
     fig.suptitle(f"{code}", fontsize=20)
-    station_stats = stations_stats[resample_rule][code]
+
+    # Per station statistics, only used for the scatter plots.
+    stations_stats = {}
+    for resample_rule, stations_combined in stations_combined_rules.items():
+        row = stations_combined.stations_df.set_index("ID", drop=False).loc[code]
+        stations_stats[resample_rule] = station_statistics.StationStats(
+            stations_combined.get_station(row)
+        )
 
     for i, irc_type in enumerate(settings_all.wiwb.keys()):
         for j, resample_rule in enumerate(["h", "d"]):
             ax = fig.add_subplot(gs[i, j])
-            station_stats = stations_stats[resample_rule][code]
+            station_stats = stations_stats[resample_rule]
             station_stats.plot_scatter_ax(irc_type=irc_type, ax=ax)
 
     stats = ["bias", "stdev"]
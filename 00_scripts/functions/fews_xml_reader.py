@@ -1,66 +1,158 @@
 from lxml import etree
+import numpy as np
 import pandas as pd
 from shapely.geometry import Point
 
-def fews_xml_to_df(timeseries_source):
-    """https://stackoverflow.com/questions/69461864/loading-a-delft-fews-series-xml-document-into-a-pandas-dataframe"""
-    with open(timeseries_source) as f:
-        # load the FEWS Series xml document
-        tree = etree.parse(f)
-
-    # relabel the None namespace to 'fews', so we can refer to it in xpath expressions
-    nsmap = tree.getroot().nsmap.copy()
-    nsmap['fews'] = nsmap.pop(None)
-    # obtain the series in the document
-    series = tree.xpath('//fews:series', namespaces=nsmap)
-
-    # create and fill a new dataframe
-    df_value = pd.DataFrame()
-    df_flag = pd.DataFrame()
-
-    class Location_header_xml():
-        def __init__(self, s):
-            self.loc_id = s.xpath('fews:header/fews:locationId/text()', namespaces=nsmap)[0]
-            self.parameter_id = s.xpath('fews:header/fews:parameterId/text()', namespaces=nsmap)[0]
-            self.name = s.xpath('fews:header/fews:stationName/text()', namespaces=nsmap)[0]
-            self.x = float(s.xpath('fews:header/fews:x/text()', namespaces=nsmap)[0])
-            self.y = float(s.xpath('fews:header/fews:y/text()', namespaces=nsmap)[0])
-            self.geometry = Point(self.x, self.y)
-        
-        def __repr__(self):
-            return f"""Location:   {self.loc_id}
+
+class Location_header_xml():
+    def __init__(self, header):
+        """header is a dict with the text of the elements in the series header."""
+        self.loc_id = header['locationId']
+        self.parameter_id = header['parameterId']
+        self.name = header['stationName']
+        self.x = float(header['x'])
+        self.y = float(header['y'])
+        self.geometry = Point(self.x, self.y)
+
+    def __repr__(self):
+        return f"""Location:   {self.loc_id}
     parameter:  {self.parameter_id}
     name:       {self.name}
     x:          {self.x}
     y:          {self.y}
     geometry:   {self.geometry}"""
 
+
+class _EventBuffer():
+    """Arrays with the date, time, value and flag attributes of the events of one series.
+    Preallocated with the number of timesteps in the header and grown when needed."""
+
+    def __init__(self, size=1024):
+        self.n = 0
+        self.date = np.empty(size, dtype=object)
+        self.time = np.empty(size, dtype=object)
+        self.value = np.empty(size, dtype=np.float64)
+        self.flag = np.empty(size, dtype=np.float64)
+
+    def _grow(self):
+        size = max(2 * len(self.value), 1024)
+        for name in ['date', 'time', 'value', 'flag']:
+            old = getattr(self, name)
+            new = np.empty(size, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def add(self, attrib):
+        if self.n == len(self.value):
+            self._grow()
+        i = self.n
+        self.date[i] = attrib['date']
+        self.time[i] = attrib['time']
+        self.value[i] = attrib.get('value', np.nan)
+        self.flag[i] = attrib.get('flag', np.nan)
+        self.n += 1
+
+    def index(self, tz):
+        """Datetime index in utc"""
+        datetime = pd.to_datetime(self.date[:self.n], format='%Y-%m-%d') + pd.to_timedelta(self.time[:self.n])
+        return pd.DatetimeIndex(datetime - pd.Timedelta(hours=tz), name='datetime')
+
+
+def _expected_events(header):
+    """Number of timesteps between start and end date of the series header, None if unknown."""
+    try:
+        start = pd.Timestamp(f"{header['startDate']['date']} {header['startDate']['time']}")
+        end = pd.Timestamp(f"{header['endDate']['date']} {header['endDate']['time']}")
+        step = pd.Timedelta(seconds=int(header['timeStep']['multiplier']))
+        return int((end - start) / step) + 1
+    except (KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _series_to_df(series, integer=False):
+    """Dataframe with the series as columns, aligned on the index of the first series.
+    With integer=True columns without missing values are cast to int64."""
+    if not series:
+        return pd.DataFrame()
+    index = next(iter(series.values())).index
+    columns = {}
+    for key, s in series.items():
+        s = s.reindex(index)
+        if integer and not s.isna().any():
+            s = s.astype(np.int64)
+        columns[key] = s
+    return pd.DataFrame(columns, index=index)
+
+
+def fews_xml_to_df(timeseries_source):
+    """Read a Delft-FEWS PI-XML timeseries export.
+
+    The document is streamed with iterparse, the events are collected in
+    arrays per series and elements are cleared as soon as they are read, so
+    memory use does not depend on the size of the document.
+
+    Returns
+    -------
+    df_value : DataFrame
+        values with (location, parameter) columns and utc datetime as index
+    df_flag : DataFrame
+        flags with the same layout as df_value
+    locations : dict[str:Location_header_xml]
+        location per locationId
+    """
+    tz = 0
+    header = None
+    buffer = None
+    series_value = {}
+    series_flag = {}
     locations = {}
 
-    #Get timezone from xml
-    for i in tree.xpath('//fews:timeZone', namespaces=nsmap):
-        tz = int(float(i.text))
-
-    for s in series:
-        location = Location_header_xml(s)
-        # location and parameter names are in the header on the series
-
-        # etree.tostring(s) is the literal xml for just the series,
-        # which read_xml accepts as source data for a new dataframe
-        series_df = pd.read_xml(etree.tostring(s), xpath='//fews:series/fews:event', namespaces=nsmap)
-        # combine the date and time columns into a single datetime and set it as the index for the dataframe
-        series_df['datetime'] = pd.to_datetime((series_df['date'] + ' ' + series_df['time']))
-        series_df['datetime'] -= pd.Timedelta(f'0{tz}:00:00') #change time to utc
-        series_df.set_index(['datetime'], inplace=True)
-        # take the value and flag columns and add them to the dataframe being constructed
-        df_value[location.loc_id, location.parameter_id] = series_df['value']
-        df_flag[location.loc_id, location.parameter_id] = series_df['flag']
-
-        #Add location to overview 
-        # #FIXME doesnt work for multiple params on same location
-        locations[location.loc_id] = location
-
-    # turn the columns labeled with tuples into a proper multi-index on the dataframe
+    context = etree.iterparse(
+        str(timeseries_source),
+        events=('end',),
+        tag=('{*}timeZone', '{*}header', '{*}event', '{*}series'),
+    )
+    for _, elem in context:
+        tag = elem.tag.rpartition('}')[2]
+
+        if tag == 'event':
+            buffer.add(elem.attrib)
+            # Remove handled elements (header and previous events) from the tree.
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        elif tag == 'header':
+            header = {}
+            for child in elem:
+                name = etree.QName(child).localname
+                header[name] = child.text if child.text is not None else dict(child.attrib)
+            buffer = _EventBuffer(size=_expected_events(header) or 1024)
+
+        elif tag == 'series':
+            location = Location_header_xml(header)
+            index = buffer.index(tz)
+            key = (location.loc_id, location.parameter_id)
+            series_value[key] = pd.Series(buffer.value[:buffer.n], index=index)
+            series_flag[key] = pd.Series(buffer.flag[:buffer.n], index=index)
+
+            # Add location to overview
+            # #FIXME doesnt work for multiple params on same location
+            locations[location.loc_id] = location
+
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            header = None
+            buffer = None
+
+        elif tag == 'timeZone':
+            # Get timezone from xml
+            tz = int(float(elem.text))
+    del context
+
+    df_value = _series_to_df(series_value)
+    df_flag = _series_to_df(series_flag, integer=True)
     df_value.columns = pd.MultiIndex.from_tuples(df_value.columns, names=['location', 'parameter'])
     df_flag.columns = pd.MultiIndex.from_tuples(df_flag.columns, names=['location', 'parameter'])
-    return df_value, df_flag, locations
\ No newline at end of file
+    return df_value, df_flag, locations
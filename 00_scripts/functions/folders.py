@@ -288,10 +288,15 @@ class InputPath(Folder):
         self.paths['station'] = {}
         self.paths['station']['raw'] = Folder(base=os.path.join(self.base, f"p_raw_station"))
         self.paths['station']['resampled'] = Folder(base=os.path.join(self.base, f"p_resampled_station"))
+        self.paths['station']['cache'] = Folder(base=os.path.join(self.base, f"p_cache_station"))
+        self.paths['station']['store'] = Folder(base=os.path.join(self.base, f"p_store_station"))
+        self.paths['station']['combined'] = Folder(base=os.path.join(self.base, f"p_combined_station"))
 
         self.paths['wiwb'] = {}
         self.paths['wiwb']['raw'] = Folder(base=os.path.join(self.base, f"p_raw_wiwb"))
         self.paths['wiwb']['resampled'] = Folder(base=os.path.join(self.base, f"p_resampled_wiwb"))
+        self.paths['wiwb']['cube'] = Folder(base=os.path.join(self.base, f"p_cube_wiwb"))
+        self.paths['wiwb']['store'] = Folder(base=os.path.join(self.base, f"p_store_wiwb"))
 
         # for data_type in self.data_types:
         #     self.paths[data_type] = {}
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import pickle
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+
+# Keys of the settings of an organisation that point to input files.
+INPUT_FILE_KEYS = ["raw_filepath", "metadata_file"]
+
+# Keys of the settings that only change how the raw data is read (e.g. the
+# number of processes for HEA), not the result. These do not invalidate the cache.
+EXECUTION_KEYS = ["processes"]
+
+
+def input_files(settings: dict) -> list:
+    """All input files (or folders) in the settings of an organisation, e.g. the
+    raw file and the HEA metadata workbook."""
+    return [settings[key] for key in INPUT_FILE_KEYS if settings.get(key) is not None]
+
+
+def list_files(paths) -> list:
+    """The files themselves, or all files in a folder (e.g. HEA and WAM have a folder with csvs).
+    paths is a single path or a list of paths."""
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(i for i in path.rglob("*") if i.is_file())
+        else:
+            files.append(path)
+    return files
+
+
+def stat_fingerprint(paths) -> list:
+    """Path, size and modification time of all input files. Cheap to compute."""
+    return [
+        {"path": str(i), "size": i.stat().st_size, "mtime": i.stat().st_mtime}
+        for i in list_files(paths)
+    ]
+
+
+def content_hash(paths, chunk_size=2**20) -> str:
+    """sha1 of the content of all input files."""
+    sha1 = hashlib.sha1()
+    for i in list_files(paths):
+        sha1.update(str(i.name).encode())
+        with open(i, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def settings_hash(settings: dict) -> str:
+    """sha1 of the settings entry of the organisation (irc_settings.IrcSettings.org),
+    without the EXECUTION_KEYS."""
+    settings = {key: value for key, value in settings.items() if key not in EXECUTION_KEYS}
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class IngestCache:
+    """Cache of the parsed raw data of an organisation (df_mask, df_value, locations).
+
+    The cache is keyed by the fingerprint of the input files (raw file(s) and
+    e.g. metadata, see input_files) and the settings of the organisation. When size and modification time of the raw files are
+    unchanged the stored content hash is trusted, otherwise the content hash is
+    recomputed, so touching a file does not invalidate the cache.
+
+    Layout:
+        {folder}/{organisation}/fingerprint.json
+        {folder}/{organisation}/value.parquet
+        {folder}/{organisation}/mask.parquet
+        {folder}/{organisation}/locations.pkl
+
+    Parameters
+    ----------
+    folder : str
+        root folder of the cache (01_data/p_cache_station)
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+
+    def path(self, organisation) -> Path:
+        return self.folder / organisation
+
+    def read_fingerprint(self, organisation):
+        fingerprint_path = self.path(organisation) / "fingerprint.json"
+        if not fingerprint_path.exists():
+            return None
+        with open(fingerprint_path) as f:
+            return json.load(f)
+
+    def fingerprint(self, organisation, paths, settings) -> dict:
+        """Fingerprint of the current input files and settings. The content hash is
+        only computed when the stat of the files differs from the cached one.
+        paths is a single path or a list of paths (see input_files)."""
+        fingerprint = {
+            "files": stat_fingerprint(paths),
+            "settings": settings_hash(settings),
+        }
+        cached = self.read_fingerprint(organisation)
+        if cached is not None and cached["files"] == fingerprint["files"]:
+            fingerprint["content"] = cached["content"]
+        else:
+            fingerprint["content"] = content_hash(paths)
+        return fingerprint
+
+    def load(self, organisation, fingerprint):
+        """Returns (df_mask, df_value, locations) when the cache is valid, otherwise None."""
+        cached = self.read_fingerprint(organisation)
+        if cached is None:
+            return None
+        if (cached["content"], cached["settings"]) != (fingerprint["content"], fingerprint["settings"]):
+            return None
+
+        path = self.path(organisation)
+        df_mask = pd.read_parquet(path / "mask.parquet")
+        df_value = pd.read_parquet(path / "value.parquet")
+        with open(path / "locations.pkl", "rb") as f:
+            locations = pickle.load(f)
+
+        if cached["files"] != fingerprint["files"]:
+            # Same content, only touched. Save new stat so the hash is skipped next time.
+            self.write_fingerprint(organisation, fingerprint)
+        return df_mask, df_value, locations
+
+    def write_fingerprint(self, organisation, fingerprint):
+        with open(self.path(organisation) / "fingerprint.json", "w") as f:
+            json.dump(fingerprint, f, indent=2)
+
+    def save(self, organisation, fingerprint, df_mask, df_value, locations):
+        path = self.path(organisation)
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+
+        df_mask.to_parquet(path / "mask.parquet")
+        df_value.to_parquet(path / "value.parquet")
+        with open(path / "locations.pkl", "wb") as f:
+            pickle.dump(locations, f)
+        # Fingerprint last, an interrupted save is not used.
+        self.write_fingerprint(organisation, fingerprint)
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
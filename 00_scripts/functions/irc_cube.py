@@ -0,0 +1,235 @@
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class IrcCube:
+    """On-disk store with the full IRC grids (time x y x x) of one product.
+
+    The grids are stored per download extent (tile) in chunks of one download
+    window:
+        {folder}/{irc_type}/{tile}/grid.json              origin, cellsize and shape
+        {folder}/{irc_type}/{tile}/{start}.npy            float32 values (time, y, x)
+        {folder}/{irc_type}/{tile}/{start}_time.npy       datetime64 of the time axis
+
+    .npy chunks are opened memory-mapped, so sampling a few stations only reads
+    the pages that are needed. With compress=True the chunks are saved as
+    compressed .npz instead, these are smaller but are read completely.
+
+    Parameters
+    ----------
+    folder : str
+        root folder of the cubes (01_data/p_cube_wiwb)
+    irc_type : str
+        product name, e.g. irc_final
+    compress : bool
+        save new chunks compressed.
+    """
+
+    def __init__(self, folder, irc_type, compress=False):
+        self.folder = Path(folder)
+        self.irc_type = irc_type
+        self.compress = compress
+        self.path = self.folder / irc_type
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tile_name(grid: dict) -> str:
+        xmax = grid["xmin"] + grid["ncols"] * grid["dx"]
+        ymin = grid["ymax"] - grid["nrows"] * grid["dy"]
+        return f"{grid['xmin']:.0f}_{ymin:.0f}_{xmax:.0f}_{grid['ymax']:.0f}"
+
+    @property
+    def tiles(self) -> list:
+        if not self.path.exists():
+            return []
+        return sorted(i for i in self.path.iterdir() if (i / "grid.json").exists())
+
+    @staticmethod
+    def load_grid(tile_path) -> dict:
+        with open(Path(tile_path) / "grid.json") as f:
+            return json.load(f)
+
+    def write_chunk(self, start, time, values, cell_index):
+        """Save the grids of one download window.
+
+        Parameters
+        ----------
+        start : datetime
+            start of the download window, used as chunk name.
+        time : array-like
+            timestamps of the rows in values.
+        values : np.ndarray
+            (time, cell) values in the order of cell_index.names, nodata as nan.
+        cell_index : wiwb.CellIndex
+            index of the downloaded cells, must be a regular grid.
+        """
+        if not cell_index.regular:
+            raise ValueError("Cells are not a regular grid, cannot store them in the cube.")
+
+        grid = {
+            "xmin": float(cell_index.xmin),
+            "ymax": float(cell_index.ymax),
+            "dx": float(cell_index.dx),
+            "dy": float(cell_index.dy),
+            "nrows": int(cell_index.nrows),
+            "ncols": int(cell_index.ncols),
+        }
+        tile_path = self.path / self.tile_name(grid)
+        with self._lock:
+            if not (tile_path / "grid.json").exists():
+                tile_path.mkdir(parents=True, exist_ok=True)
+                with open(tile_path / "grid.json", "w") as f:
+                    json.dump(grid, f)
+
+        cube = np.full((len(values), grid["nrows"], grid["ncols"]), np.nan, dtype=np.float32)
+        cube[:, cell_index.rows, cell_index.cols] = values
+
+        name = pd.Timestamp(start).strftime("%Y%m%d")
+        for old in tile_path.glob(f"{name}.np*"):
+            old.unlink()  # A partial window is replaced when it is downloaded again.
+        if self.compress:
+            np.savez_compressed(tile_path / f"{name}.npz", values=cube)
+        else:
+            np.save(tile_path / f"{name}.npy", cube)
+        np.save(tile_path / f"{name}_time.npy", pd.to_datetime(time).values.astype("datetime64[ns]"))
+
+    def chunks(self, tile_path, start=None, end=None) -> list:
+        """Chunk names of a tile that can contain data between start and end."""
+        names = sorted(i.stem for i in Path(tile_path).glob("*_time.npy"))
+        chunks = []
+        for name in names:
+            name = name.replace("_time", "")
+            time = np.load(Path(tile_path) / f"{name}_time.npy")
+            if len(time) == 0:
+                continue
+            if start is not None and time[-1] < np.datetime64(pd.Timestamp(start)):
+                continue
+            if end is not None and time[0] > np.datetime64(pd.Timestamp(end)):
+                continue
+            chunks.append(name)
+        return chunks
+
+    @staticmethod
+    def load_chunk(tile_path, name):
+        """Returns time and (time, y, x) values of a chunk. Uncompressed chunks are memory-mapped."""
+        tile_path = Path(tile_path)
+        time = np.load(tile_path / f"{name}_time.npy")
+        if (tile_path / f"{name}.npy").exists():
+            values = np.load(tile_path / f"{name}.npy", mmap_mode="r")
+        else:
+            with np.load(tile_path / f"{name}.npz") as f:
+                values = f["values"]
+        return time, values
+
+    def sample(self, points: dict, start=None, end=None, radius=0) -> pd.DataFrame:
+        """Timeseries of the cells that contain the points.
+
+        Parameters
+        ----------
+        points : dict[str:Point]
+            Dict of point names with corresponding shapely coordinate points.
+        start, end : datetime, optional
+            period to sample
+        radius : int
+            0 samples the cell of the point, otherwise the mean of the
+            (2*radius+1)**2 surrounding cells is returned.
+
+        Returns
+        -------
+        DataFrame
+            DateTime as index and a column per point. Points outside all tiles
+            are not returned. A point can be in several tiles (the extent of a
+            download changes when a station is added), the chunks of all those
+            tiles are combined and of duplicate timestamps the newest chunk is used.
+        """
+        names = np.array(list(points.keys()))
+        x = np.array([point.x for point in points.values()], dtype=float)
+        y = np.array([point.y for point in points.values()], dtype=float)
+
+        # (mtime, tile, chunk, frame) of every chunk with the points in that tile.
+        tiles = []
+        df_chunks = []
+        for tile_path in self.tiles:
+            grid = self.load_grid(tile_path)
+            col = np.floor((x - grid["xmin"]) / grid["dx"]).astype(int)
+            row = np.floor((grid["ymax"] - y) / grid["dy"]).astype(int)
+            inside = (col >= 0) & (col < grid["ncols"]) & (row >= 0) & (row < grid["nrows"])
+            tiles.append(inside)
+            if not inside.any():
+                continue
+
+            for name in self.chunks(tile_path, start=start, end=end):
+                time, values = self.load_chunk(tile_path, name)
+                if radius == 0:
+                    data = values[:, row[inside], col[inside]]
+                else:
+                    data = np.stack(
+                        [
+                            np.nanmean(
+                                values[
+                                    :,
+                                    max(r - radius, 0) : r + radius + 1,
+                                    max(c - radius, 0) : c + radius + 1,
+                                ],
+                                axis=(1, 2),
+                            )
+                            for r, c in zip(row[inside], col[inside])
+                        ],
+                        axis=1,
+                    )
+                mtime = (Path(tile_path) / f"{name}_time.npy").stat().st_mtime
+                df_chunks.append(
+                    (
+                        mtime,
+                        len(tiles) - 1,
+                        name,
+                        pd.DataFrame(np.asarray(data), index=pd.DatetimeIndex(time), columns=names[inside]),
+                    )
+                )
+        df_chunks.sort(key=lambda i: i[:3])
+
+        found = np.any(tiles, axis=0) if tiles else np.zeros(len(names), dtype=bool)
+        if not df_chunks:
+            return pd.DataFrame(columns=names[found], dtype=np.float32)
+
+        # Points in the same tiles share their chunks.
+        groups = {}
+        for i in np.flatnonzero(found):
+            groups.setdefault(tuple(inside[i] for inside in tiles), []).append(names[i])
+
+        df_groups = []
+        for key, columns in groups.items():
+            frames = [df[columns] for _, tile, _, df in df_chunks if key[tile]]
+            if frames:
+                df_group = pd.concat(frames)
+                df_groups.append(df_group[~df_group.index.duplicated(keep="last")])
+
+        df = pd.concat(df_groups, axis=1).sort_index().reindex(columns=names[found])
+        df.index.name = "DateTime"
+        df.columns.name = "Locatie"
+        return df.loc[start:end]
+
+    def get_grid(self, timestamp) -> dict:
+        """2d grid of every tile at a timestamp, e.g. for spatial maps.
+
+        Returns
+        -------
+        dict[str:tuple[dict, np.ndarray]]
+            tile name: (grid definition, (y, x) values)
+        """
+        timestamp = np.datetime64(pd.Timestamp(timestamp))
+        grids = {}
+        for tile_path in self.tiles:
+            for name in self.chunks(tile_path, start=timestamp, end=timestamp):
+                time, values = self.load_chunk(tile_path, name)
+                idx = np.flatnonzero(time == timestamp)
+                if len(idx):
+                    grids[tile_path.name] = (self.load_grid(tile_path), np.array(values[idx[-1]]))
+        return grids
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
@@ -27,6 +27,7 @@ class IrcSettings:
                 "sep": ";",
                 "date_col": "Timestamp",
                 "metadata_file": folder.input.full_path("HEA_P_metadata2.xlsx"),
+                "processes": None,  # Number of processes to load the csvs, None uses all cores. Serial in prepare_parallel. Scripts need a __main__ guard.
             },
             "WF": {
                 "raw_filepath": folder.input.paths["station"]["raw"].full_path(
@@ -50,7 +51,7 @@ class IrcSettings:
             "irc_realtime": {
                 "raw_filepaths": [
                     i
-                    for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+                    for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
                         "*irc_realtime_raw*.parquet"
                     )
                 ]
@@ -58,7 +59,7 @@ class IrcSettings:
             "irc_early": {
                 "raw_filepaths": [
                     i
-                    for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+                    for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
                         "*irc_early_raw*.parquet"
                     )
                 ]
@@ -66,7 +67,7 @@ class IrcSettings:
             "irc_final": {
                 "raw_filepaths": [
                     i
-                    for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+                    for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
                         "*irc_final_raw*.parquet"
                     )
                 ]
@@ -74,7 +75,7 @@ class IrcSettings:
             "irc_realtime_beta": {
                 "raw_filepaths": [
                     i
-                    for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+                    for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
                         "*irc_realtime_beta_raw*.parquet"
                     )
                 ]
@@ -82,7 +83,7 @@ class IrcSettings:
             # "irc_early_beta": {
             #     "raw_filepaths": [
             #         i
-            #         for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+            #         for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
             #             "*irc_early_beta_raw*.parquet"
             #         )
             #     ]
@@ -90,9 +91,13 @@ class IrcSettings:
             # "irc_final_beta": {
             #     "raw_filepaths": [
             #         i
-            #         for i in folder.input.paths["wiwb"]["raw"].pl.glob(
+            #         for i in folder.input.paths["wiwb"]["raw"].pl.rglob(
             #             "*irc_final_beta_raw*.parquet"
             #         )
             #     ]
             # },
         }
+
+        # Resolutions of the resampled timeseries (pandas resample rules), e.g.
+        # ["5min", "h", "3h", "d"]. Coarser rules are derived from finer ones.
+        self.resample_rules = ["h", "d"]
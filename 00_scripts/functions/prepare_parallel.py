@@ -0,0 +1,134 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import functions.station_cls as station_cls
+
+
+def resample_organisation(
+    folder,
+    organisation,
+    settings,
+    overwrite=True,
+    resample_rules=station_cls.RESAMPLE_RULES,
+    incremental=False,
+):
+    """Resample the timeseries of a single organisation. Runs in a worker process.
+
+    The locations are returned instead of added to the gpkg, the gpkg is only
+    written by the main process (see prepare_all).
+
+    Returns
+    -------
+    tuple[str, locations, float]
+        organisation, locations for add_locations_to_gpkg and duration in seconds
+    """
+    t0 = time.time()
+    stations_organisation = station_cls.Stations_organisation(
+        folder=folder,
+        organisation=organisation,
+        settings=settings,
+        resample_rules=resample_rules,
+    )
+    locations = stations_organisation.resample(overwrite=overwrite, incremental=incremental)
+    return organisation, locations, time.time() - t0
+
+
+def resample_wiwb(
+    folder,
+    settings,
+    overwrite=True,
+    source="raw",
+    resample_rules=station_cls.RESAMPLE_RULES,
+    incremental=False,
+):
+    """Resample the wiwb timeseries. Runs in a worker process."""
+    t0 = time.time()
+    wiwb_combined = station_cls.Wiwb_combined(
+        folder=folder, settings=settings, source=source, resample_rules=resample_rules
+    )
+    wiwb_combined.resample(overwrite=overwrite, incremental=incremental)
+    return "wiwb", None, time.time() - t0
+
+
+def prepare_all(
+    folder, settings_all, max_workers=None, overwrite=True, wiwb_source="raw", incremental=False
+):
+    """Resample all organisations and the wiwb products in a process pool.
+
+    Every organisation is an independent job, so the duration is bounded by
+    the slowest organisation. The ground_stations.gpkg is read by all jobs,
+    therefore the locations are only added to the gpkg after all jobs are
+    finished, one organisation at a time by this (single) process.
+
+    Parameters
+    ----------
+    folder : folders.Folders
+    settings_all : irc_settings.IrcSettings
+    max_workers : int
+        number of processes, None uses all cores.
+    overwrite : bool
+        passed to the resample functions.
+    wiwb_source : str
+        source of Wiwb_combined, "raw" or "cube".
+    incremental : bool
+        only resample the new raw data, see Stations_organisation.resample.
+
+    Returns
+    -------
+    dict[str:float]
+        duration per job in seconds
+    """
+    locations_org = {}
+    durations = {}
+    errors = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                resample_organisation,
+                folder,
+                organisation,
+                settings,
+                overwrite,
+                settings_all.resample_rules,
+                incremental,
+            ): organisation
+            for organisation, settings in settings_all.org.items()
+        }
+        futures[
+            executor.submit(
+                resample_wiwb,
+                folder,
+                settings_all.wiwb,
+                overwrite,
+                wiwb_source,
+                settings_all.resample_rules,
+                incremental,
+            )
+        ] = "wiwb"
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                name, locations, duration = future.result()
+            except Exception as e:
+                errors[name] = e
+                print(f"{name} failed -- {e!r}")
+                continue
+            locations_org[name] = locations
+            durations[name] = duration
+            print(f"{name} resampled in {duration:.1f}s")
+
+    # Single writer for the gpkg, in the order of the settings.
+    for organisation, settings in settings_all.org.items():
+        if organisation not in locations_org:
+            continue
+        stations_organisation = station_cls.Stations_organisation(
+            folder=folder,
+            organisation=organisation,
+            settings=settings,
+        )
+        stations_organisation.add_locations_to_gpkg(locations_org[organisation])
+
+    if errors:
+        raise RuntimeError(f"Resample failed for {list(errors)}") from next(iter(errors.values()))
+    return durations
@@ -1,21 +1,172 @@
 import pandas as pd
 import os
+import shutil
+import csv
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import functions.fews_xml_reader as fews_xml_reader
-from functools import reduce
+import functions.irc_cube as irc_cube
+import functions.ingest_cache as ingest_cache
+import functions.timeseries as timeseries
+import functions.ts_store as ts_store
 import numpy as np
 import geopandas as gpd
+import openpyxl
 from pathlib import Path
+from collections.abc import Mapping
 import hhnk_research_tools as hrt
 from shapely.geometry import Point
 
 
-RESAMPLE_TEXT = {"h": "1h", "d": "24h"}
+RESAMPLE_TEXT = {"5min": "5min", "h": "1h", "3h": "3h", "d": "24h"}
+RESAMPLE_RULES = ["h", "d"]  # Default resolutions of the resampled timeseries.
+
+
+def load_hea_csv(raw_fp, settings):
+    """Load and resample the csv of a single HEA station. The metadata header and
+    the timeseries are read in one pass. Defined on module level so it can run in
+    a process pool.
+
+    Returns
+    -------
+    tuple[str, pd.Series, pd.Series]
+        station id, value series and mask series
+    """
+    resample_rule_hea = {
+        "5m.Totaal.O": "5min",
+        "Totals.5m.O": "5min",
+        "Totaal.60.O": "h",
+    }
+
+    # Same encoding as pd.read_csv, independent of the platform default.
+    with open(raw_fp, encoding=settings.get("encoding", "utf-8")) as f:
+        # Get metadata from headers of csv, first line is the header of the metadata.
+        header = [
+            next(csv.reader([f.readline()], delimiter=settings["sep"]))
+            for _ in range(settings["skiprows"])
+        ]
+        meta = {row[0]: row[1] for row in header[1:] if len(row) > 1}
+        station_id = meta["site_no"]
+        station_param = meta["ts_name"]
+
+        # Load timeseries
+        df = pd.read_csv(f, sep=settings["sep"])
+
+    df.rename(
+        {
+            settings["date_col"]: "datetime",
+            "Value": "value",
+            "Quality Code": "flag",
+        },
+        inplace=True,
+        axis=1,
+    )
+
+    # Set datetime as index
+    df["datetime"] = pd.to_datetime(df["datetime"], format="%d-%m-%Y %H:%M:%S")
+    df.set_index("datetime", inplace=True)
+    df.drop("Timeseries Comment", axis=1, inplace=True)
+
+    # Resample
+    df = df.resample(resample_rule_hea[station_param]).sum()
+
+    # Split into mask and value series
+    df_value_single = df["value"].copy()  # values
+    df_value_single.name = station_id
+
+    # Create a mask df from the flags
+    df_mask_single = df["flag"].copy()  # flags
+
+    # Replace string values with mask, to identify which timeseries we do use.
+    masked_values = {200: False, "0": True}
+    df_mask_single.replace(masked_values, inplace=True)
+    df_mask_single.name = station_id
+    return station_id, df_value_single, df_mask_single
+
+
+def load_wf_xlsx(raw_fp, settings):
+    """Load the WF workbook. The sheet is streamed with openpyxl in read-only
+    mode, which is much faster than pd.read_excel on this file.
+
+    Layout of the sheet: a header row, 3 rows with metadata (the 2nd row has
+    the names and the 3rd the ID of the stations) and then a row per timestep
+    with the time in CET/CEST in the first column, e.g. "ma 01-01-2022 00:00".
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        values with a column per station ID and utc datetime index, locations
+        with WEERGAVENAAM and ID.
+    """
+    workbook = openpyxl.load_workbook(raw_fp, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(min_row=settings["skiprows"] + 1, values_only=True)
+        header = next(rows)
+        # Trailing empty cells can be missing in read-only mode, pad to the header.
+        ncols = len(header)
+        rows = (row + (None,) * (ncols - len(row)) for row in rows)
+        meta = [next(rows) for _ in range(3)]
+        data = list(rows)
+    finally:
+        workbook.close()
+
+    # Get location information (only weergavenaam and ID. We need xy..)
+    locations = pd.DataFrame(
+        {"WEERGAVENAAM": meta[1][1:], "ID": meta[2][1:]}, index=meta[2][1:]
+    )
+
+    # Timestamps start with the weekday ("ma ") which is stripped.
+    data = [row for row in data if row[0] is not None]
+    datetime = pd.to_datetime(
+        pd.Series([row[0] for row in data], dtype=str).str.slice(3),
+        format="%d-%m-%Y %H:%M",
+    )
+    values = [row[1:] for row in data]
+    try:
+        values = np.array(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        # Text cells (e.g. "-" or "n.v.t.") become nan, so they are masked.
+        values = pd.DataFrame(values).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    df_value = pd.DataFrame(
+        values,
+        index=pd.DatetimeIndex(datetime, name="datetime"),
+        columns=locations["ID"].values,
+    )
+
+    # Convert CET/CEST to UTC
+    df_value = df_value.tz_localize("CET", ambiguous="infer").tz_convert("UTC")
+    df_value = df_value.tz_localize(None)  # remove tz info so we can merge.
+    return df_value, locations
+
+
+class LazyFrames(Mapping):
+    """Dict of dataframes that are loaded with loader(key) on first access."""
+
+    def __init__(self, loader, keys):
+        self.loader = loader
+        self.keys_ = list(keys)
+        self.frames = {}
+
+    def __getitem__(self, key):
+        if key not in self.keys_:
+            raise KeyError(key)
+        if key not in self.frames:
+            self.frames[key] = self.loader(key)
+        return self.frames[key]
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
 
 
 class Station:
     """Individual station with related timeseries."""
 
-    def __init__(self, folder, row, resample_rule, df, irc_types):
+    def __init__(self, folder, row, resample_rule, df=None, irc_types=None, cube=None):
         self.row = row
         self.name = row["WEERGAVENAAM"]
         self.code = row["ID"]
@@ -24,12 +175,19 @@ class Station:
         self.resample_rule = resample_rule
         self.irc_types = irc_types
 
-        # Timeseries
-        self.df = df
+        # Timeseries, a dataframe or a view on the cube of Stations_combined.
+        self._df = df
+        self.cube = cube
+
+    @property
+    def df(self):
+        if self._df is None:
+            return self.cube.frame(self.code)
+        return self._df
 
     @property
     def resample_text(self):
-        return RESAMPLE_TEXT[self.resample_rule]
+        return RESAMPLE_TEXT.get(self.resample_rule, self.resample_rule)
 
     def __repr__(self):
         return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
@@ -38,30 +196,132 @@ class Station:
 class Stations_organisation:
     """All stations of a single organisation with related timeseries."""
 
-    def __init__(self, folder, organisation, settings):
+    def __init__(self, folder, organisation, settings, resample_rules=RESAMPLE_RULES):
         self.organisation = organisation
         self.folder = folder
         self.settings = settings
-        self.stations_df = self.load_stations_gdf()
+        self.resample_rules = resample_rules
+        self._stations_df = None
 
         self.out_path = self.set_out_path()
+        self.store = ts_store.TimeseriesStore(
+            self.folder.input.paths["station"]["store"].path
+        )
+        self.cache = ingest_cache.IngestCache(
+            self.folder.input.paths["station"]["cache"].path
+        )
 
         # self.df_mask, self.df_value = self.load_ts_raw(date_col, skiprows, sep)
 
-    def load_ts_raw(self) -> pd.DataFrame:
-        """Load raw data. Returns a mask and value dataframe
-        including all stations for that organisation #TODO only works for HHNK data."""
+    def load_ts_raw(self, use_cache=True) -> pd.DataFrame:
+        """Load raw data. Returns a mask and value dataframe including all stations
+        for that organisation. The parsed raw data is cached, it is only parsed
+        again when the input files (raw and metadata) or the settings of the
+        organisation change."""
+        if use_cache:
+            fingerprint = self.cache.fingerprint(
+                self.organisation, ingest_cache.input_files(self.settings), self.settings
+            )
+            cached = self.cache.load(self.organisation, fingerprint)
+            if cached is not None:
+                df_mask, df_value, locations = cached
+            else:
+                df_mask, df_value, locations = self.parse_ts_raw()
+                self.cache.save(
+                    self.organisation, fingerprint, df_mask, df_value, locations
+                )
+        else:
+            df_mask, df_value, locations = self.parse_ts_raw()
+
+        # Mask station data before start_date, after end_date and within the
+        # exclusion periods of the stations_df
+        df_mask = df_mask | timeseries.interval_mask(
+            df_mask.index, df_mask.columns, self.excluded_intervals()
+        )
+
+        return df_mask, df_value, locations
+
+    def excluded_intervals(self) -> list:
+        """Periods per station that should be masked, from the columns in the gpkg:
+            start_date      data before this date is masked
+            end_date        (optional) data from this date onwards is masked
+            exclude         (optional) periods to mask, "start..end;start..end".
+                            Leave start or end empty for an open period.
+
+        Returns
+        -------
+        list[tuple[str, pd.Timestamp, pd.Timestamp]]
+            (ID, start, end) of every masked period, None is unbounded.
+
+        Raises
+        ------
+        ValueError
+            When an exclude period of a station cannot be read.
+        """
+        stations_df = self.stations_df.set_index("ID")
+        intervals = []
+        if "start_date" in stations_df:
+            start_date = pd.to_datetime(stations_df["start_date"], errors="coerce").dropna()
+            intervals += [(station, None, date) for station, date in start_date.items()]
+        if "end_date" in stations_df:
+            end_date = pd.to_datetime(stations_df["end_date"], errors="coerce").dropna()
+            intervals += [(station, date, None) for station, date in end_date.items()]
+        if "exclude" in stations_df:
+            for station, periods in stations_df["exclude"].dropna().items():
+                for period in str(periods).split(";"):
+                    if period.strip() == "":
+                        continue
+                    intervals.append((station, *self.parse_period(station, period)))
+        return intervals
+
+    @staticmethod
+    def parse_period(station, period):
+        """(start, end) of a period "start..end" in the exclude column, None is unbounded.
+        Dates can contain "/" or "-", the day comes first (01/02/2022 is 1 February),
+        ISO dates (2022-02-01 12:00) are also read."""
+        parts = [i.strip() for i in period.split("..")]
+        try:
+            if len(parts) != 2:
+                raise ValueError("expected one '..' between start and end")
+            start, end = [
+                None if not i else pd.Timestamp(i) if i[:4].isdigit() else pd.to_datetime(i, dayfirst=True)
+                for i in parts
+            ]
+        except (ValueError, TypeError) as e:
+            raise ValueError(
+                f"Invalid exclude period {period.strip()!r} of station {station} in "
+                f"ground_stations.gpkg, use 'start..end' -- {e}"
+            ) from None
+        return start, end
+
+    def parse_ts_raw(self):
+        """Parse the raw data of the organisation into a mask and value dataframe."""
 
         if self.organisation == "HHNK":
+            skiprows = self.settings["skiprows"]
+            columns = pd.read_csv(
+                self.settings["raw_filepath"],
+                sep=self.settings["sep"],
+                skiprows=skiprows,
+                nrows=0,
+            ).columns
+
+            # Columns are datetime followed by a value and quality column per station.
+            dtype = {col: "float64" for col in columns[1::2]}
+            dtype.update({col: "category" for col in columns[2::2]})
+
             df = pd.read_csv(
                 self.settings["raw_filepath"],
                 sep=self.settings["sep"],
-                skiprows=self.settings["skiprows"],
-            )  # , parse_dates=[date_col])
+                skiprows=list(range(skiprows)) + [skiprows + 1],  # Skip first row.
+                index_col=0,
+                decimal=",",
+                dtype=dtype,
+                engine="c",
+            )
 
             df.rename(
                 {
-                    self.settings["date_col"]: "datetime",
                     "P.meting.1m": "value",
                     "P.meting.1m quality": "flag",
                 },
@@ -70,34 +330,20 @@ class Stations_organisation:
             )
 
             # Set datetime as index
-            df["datetime"] = pd.to_datetime(df["datetime"]) - pd.Timedelta(
+            df.index = pd.to_datetime(df.index) - pd.Timedelta(
                 f"01:00:00" #De data staat in UTC+1 (tijdreeksen FEWS komen in winter overeen en in zomer zijn de tijden uit de csv -1 uur tov fews.)
             )  # change time to utc
-            df.set_index("datetime", inplace=True)
-
-            df = df.iloc[1:]  # Skip first row.
+            df.index.name = "datetime"
 
-            # Create a mask df from the flags
-            df_mask = df.iloc[:, 1::2].copy()  # flags
-
-            # Replace string values with mask, to identify which timeseries we do use.
-            masked_values = {"original reliable": False, "completed unreliable": True}
-            df_mask.replace(masked_values, inplace=True)
+            # Create a mask df from the flags, to identify which timeseries we do use.
+            # Only "original reliable" values are used ("completed unreliable" is masked).
+            df_flag = df.iloc[:, 1::2]
+            df_mask = df_flag.notna() & (df_flag != "original reliable")
 
             # Rename columns to match value df
             df_mask.columns = df_mask.keys().str.replace(" quality", "").values
             df_value = df.iloc[:, 0::2].copy()  # values
 
-            # Set obtype to float
-            def str_to_float(x):
-                try:
-                    return float(x.replace(",", "."))
-                except:
-                    return float(x)
-
-            df_value = df_value.applymap(str_to_float)
-            df_value.astype(float)
-
             locations = None
 
         if self.organisation in ["HDSR", "WL"]:
@@ -115,62 +361,25 @@ class Stations_organisation:
             df_mask = df_flag != 0
 
         if self.organisation == "HEA":
-            resample_rule_hea = {
-                "5m.Totaal.O": "5min",
-                "Totals.5m.O": "5min",
-                "Totaal.60.O": "h",
-            }
+            # Every station is a separate csv, load them in a process pool.
+            raw_fps = sorted(Path(self.settings["raw_filepath"]).glob("*csv"))
+            processes = self.settings.get("processes")
+            # Within a worker of prepare_parallel no nested pool is started. The
+            # workers import the calling script again (spawn), so a script that
+            # loads HEA must guard that code with `if __name__ == "__main__"`.
+            if processes == 1 or multiprocessing.parent_process() is not None:
+                results = [load_hea_csv(raw_fp, self.settings) for raw_fp in raw_fps]
+            else:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    results = list(
+                        pool.map(load_hea_csv, raw_fps, repeat(self.settings))
+                    )
 
-            df_mask_dict = {}
             df_value_dict = {}
-            for raw_fp in Path(self.settings["raw_filepath"]).glob("*csv"):
-
-                # Get metadata from headers of csv
-                df_meta = pd.read_csv(
-                    raw_fp, sep=self.settings["sep"], nrows=8
-                ).set_index("ts_id")
-                station_id = df_meta.loc["site_no"].values[0]
-                station_param = df_meta.loc["ts_name"].values[0]
-
-                # Load timeseries
-                df = pd.read_csv(
-                    raw_fp, sep=self.settings["sep"], skiprows=self.settings["skiprows"]
-                )  # , parse_dates=[date_col])
-
-                df.rename(
-                    {
-                        self.settings["date_col"]: "datetime",
-                        "Value": "value",
-                        "Quality Code": "flag",
-                    },
-                    inplace=True,
-                    axis=1,
-                )
-
-                # Set datetime as index
-                df["datetime"] = pd.to_datetime(
-                    df["datetime"], format="%d-%m-%Y %H:%M:%S"
-                )
-                df.set_index("datetime", inplace=True)
-                df.drop("Timeseries Comment", axis=1, inplace=True)
-
-                # Resample
-                df = df.resample(resample_rule_hea[station_param]).sum()
-
-                # Split into mask and value series
-                df_value_single = df["value"].copy()  # values
-                df_value_single.name = station_id
-
-                # Create a mask df from the flags
-                df_mask_single = df["flag"].copy()  # flags
-
-                # Replace string values with mask, to identify which timeseries we do use.
-                masked_values = {200: False, "0": True}
-                df_mask_single.replace(masked_values, inplace=True)
-                df_mask_single.name = station_id
-
-                df_value_dict[station_id] = df_value_single.copy()
-                df_mask_dict[station_id] = df_mask_single.copy()
+            df_mask_dict = {}
+            for station_id, df_value_single, df_mask_single in results:
+                df_value_dict[station_id] = df_value_single
+                df_mask_dict[station_id] = df_mask_single
 
             df_value = self.merge_df_datetime(df_value_dict)
             df_mask = self.merge_df_datetime(df_mask_dict)
@@ -179,89 +388,50 @@ class Stations_organisation:
             locations = pd.read_excel(self.settings["metadata_file"])
 
         if self.organisation == "WF":
+            df_value, locations = load_wf_xlsx(
+                self.settings["raw_filepath"], self.settings
+            )
 
-            df = pd.read_excel(
-                self.settings["raw_filepath"],
-                skiprows=self.settings["skiprows"],
-                engine="openpyxl",
-            )  # , parse_dates=[date_col])
-
-            df.loc[2, self.settings["date_col"]] = self.settings["date_col"]
-            df.columns = df.iloc[2]
-
-            # Get location information (only weergavenaam and ID. We need xy..)
-            meta_rows = [0, 1, 2]
-            locations = df.loc[meta_rows].T[[1, 2]].iloc[1:]
-            locations.rename({1: "WEERGAVENAAM", 2: "ID"}, axis=1, inplace=True)
+            # Create mask
+            df_mask = df_value.isna()
 
-            df.drop([0, 1, 2], axis=0, inplace=True)
+        if self.organisation == "WAM":
+            # WAM has multiple csvs in long format (datetime, object_id, value).
+            # Read them all and reshape to one column per station at once.
+            df = pd.concat(
+                [
+                    pd.read_csv(
+                        raw_fp,
+                        sep=self.settings["sep"],
+                        skiprows=self.settings["skiprows"],
+                        usecols=[self.settings["date_col"], "object_id", "sum_value"],
+                        dtype={"object_id": "str", "sum_value": "float64"},
+                    )
+                    for raw_fp in sorted(Path(self.settings["raw_filepath"]).glob("*csv"))
+                ],
+                ignore_index=True,
+            )
 
             df.rename(
                 {
                     self.settings["date_col"]: "datetime",
-                    "P.meting.1m": "value",
-                    "P.meting.1m quality": "flag",
+                    "sum_value": "value",
                 },
                 inplace=True,
                 axis=1,
             )
 
-            # Set datetime as index
-            df["datetime"] = pd.to_datetime(
-                df["datetime"].apply(lambda x: x[3:]), format="%d-%m-%Y %H:%M"
-            )
-            df.set_index("datetime", inplace=True)
+            df["datetime"] = pd.to_datetime(df["datetime"], format="%Y-%m-%d %H:%M:%S")
+            df["object_id"] = df["object_id"].astype("category")
 
-            # Convert CET/CEST to UTC
-            df = df.tz_localize("CET", ambiguous="infer").tz_convert("UTC")
-            df = df.tz_localize(None)  # remove tz info so we can merge.
+            # create one column per station, data is already UTC.
+            df = df.drop_duplicates(subset=["datetime", "object_id"], keep="last")
+            df_value = df.set_index(["datetime", "object_id"])["value"].unstack("object_id")
+            df_value.columns = df_value.columns.astype(str)
+            df_value.columns.name = None
 
-            df_value = df
-            df_value.astype(float)
-
-            # Create mask
             df_mask = df_value.isna()
 
-        if self.organisation == "WAM":
-            #WAM has 2 csvs
-            df_value_dict = {}
-            for raw_fp in Path(self.settings["raw_filepath"]).glob("*csv"):
-                # Load timeseries
-                df = pd.read_csv(
-                    raw_fp, sep=self.settings["sep"], skiprows=self.settings["skiprows"]
-                )  # , parse_dates=[date_col])
-
-                df.rename(
-                    {
-                        self.settings["date_col"]: "datetime",
-                        "sum_value": "value",
-                    },
-                    inplace=True,
-                    axis=1,
-                )
-
-                # Set datetime as index
-                df["datetime"] = pd.to_datetime(
-                    df["datetime"], format="%Y-%m-%d %H:%M:%S"
-                )
-                df.set_index("datetime", inplace=True)
-                
-                df = df.tz_localize(None)  # data is alreadt UTC remove tz info so we can merge.
-                
-                #create one column per station
-                df2 = pd.DataFrame()
-                for col in df["object_id"].unique():
-                    df2[col] = df.loc[df["object_id"]==col, "value"]
-
-
-                # Split into mask and value series
-                df_value_single = df2.copy()  # values
-
-                df_value_dict[raw_fp] = df_value_single.copy()
-
-            df_value = self.merge_df_datetime(df_value_dict)            
-            df_mask = df_value.isna()
-            
             locations=None
 
         # make sure negative values are masked
@@ -275,74 +445,85 @@ class Stations_organisation:
         df_mask.fillna(
             fillna_value, inplace=True
         )  # Resample doesnt handle Nan values well.
-
-        #filter station data with start_date before start_date in stations_df
-        gdf_filter = self.stations_df[self.stations_df["start_date"].notna()] #filter stations with startdate
-        gdf_filter = gdf_filter[gdf_filter["ID"].isin(df_mask.keys())] #filter available stations
-        for index, row in gdf_filter.iterrows():
-            df_mask.loc[df_mask[row["ID"]].index < row["start_date"], row["ID"]] = True
+        df_mask = df_mask.astype(bool)
 
         return df_mask, df_value, locations
 
     @staticmethod
-    def merge_df_datetime(dict_df):
+    def merge_df_datetime(dict_df, fill_value=np.nan):
         """Combine all dataframes in a dictionary into one single df."""
-        return reduce(
-            lambda left, right: pd.merge(
-                left, right, left_index=True, right_index=True, how="outer"
-            ),
-            dict_df.values(),
-        )
+        return timeseries.align_frames(dict_df, fill_value=fill_value)
 
     def set_out_path(self):
-        """set output paths of resampled dataframes"""
+        """set output paths of resampled dataframes. These are the separate files
+        per resolution of older versions, they are only read when the
+        organisation is not in the store (ts_store.TimeseriesStore)."""
         out_path = {}
         out_path["value"] = {}
         out_path["mask"] = {}
-        for resample_rule in ["h", "d"]:
+        for resample_rule in self.resample_rules:
+            resample_text = RESAMPLE_TEXT.get(resample_rule, resample_rule)
             out_path["value"][resample_rule] = self.folder.input.paths["station"][
                 "resampled"
-            ].full_path(f"{self.organisation}_p_{RESAMPLE_TEXT[resample_rule]}.parquet")
+            ].full_path(f"{self.organisation}_p_{resample_text}.parquet")
             out_path["mask"][resample_rule] = self.folder.input.paths["station"][
                 "resampled"
             ].full_path(
-                f"{self.organisation}_mask_{RESAMPLE_TEXT[resample_rule]}.parquet"
+                f"{self.organisation}_mask_{resample_text}.parquet"
             )
         return out_path
 
-    def resample(self, overwrite=True):
-        """Resample measured values to hour and day data. Save to file"""
+    def resample(self, overwrite=True, incremental=False):
+        """Resample measured values to the resample_rules (default hour and day data).
+        Save to file.
+
+        With incremental=True only the raw data from the last stored bin onwards
+        (ts_store.TimeseriesStore.resume_from) is resampled and merged into the
+        store. Changes in older raw data are then not picked up."""
 
         cont = [True]
         # First check if all output already exists
-        if overwrite == False:
-            for resample_rule in ["h", "d"]:
-                if os.path.exists(self.out_path["value"][resample_rule]):
-                    cont.append(False)
+        if overwrite == False and incremental == False:
+            if self.organisation in self.store.sources:
+                cont.append(False)
 
         if np.all(cont) == True:
             # Load raw values
             df_mask, df_value, locations = self.load_ts_raw()
 
-            for resample_rule in ["h", "d"]:
-                # Resample
-                df_value_resampled = pd.DataFrame(
-                    df_value.resample(resample_rule).sum()
-                )
-                df_mask_resampled = pd.DataFrame(df_mask.resample(resample_rule).sum())
+            since = None
+            if incremental:
+                since = self.store.resume_from(self.organisation, self.resample_rules)
+            if since is not None:
+                df_value = df_value[df_value.index >= since]
+                df_mask = df_mask[df_mask.index >= since]
 
-                # Recreate mask
-                df_mask_resampled = df_mask_resampled != 0
+            # Resample, coarser rules are derived from the finer results.
+            resampled = timeseries.cascade_resample(
+                df_value, df_mask, resample_rules=self.resample_rules
+            )
 
-                # Save to file
-                df_value_resampled.to_parquet(self.out_path["value"][resample_rule])
-                df_mask_resampled.to_parquet(self.out_path["mask"][resample_rule])
+            # Save to file
+            if since is None:
+                self.store.write(self.organisation, resampled, replace=True)
+            else:
+                self.store.update(self.organisation, resampled)
             return locations
 
-    def load(self, resample_rule="h"):
-        """Load timeseres from file"""
-        self.df_value = pd.read_parquet(self.out_path["value"][resample_rule])
-        self.df_mask = pd.read_parquet(self.out_path["mask"][resample_rule])
+    def load(self, resample_rule="h", stations=None, start=None, end=None):
+        """Load timeseres from file. Only the stations and period that are given
+        are read from the store."""
+        if self.organisation in self.store.sources:
+            self.df_value, self.df_mask = self.store.query(
+                self.organisation, resample_rule, stations=stations, start=start, end=end
+            )
+        else:
+            self.df_value = ts_store.read_wide(
+                self.out_path["value"][resample_rule], columns=stations, start=start, end=end
+            )
+            self.df_mask = ts_store.read_wide(
+                self.out_path["mask"][resample_rule], columns=stations, start=start, end=end
+            )
 
     # Toevoegen locaties van xml aan de gpkg
     def add_locations_to_gpkg(self, locations):
@@ -397,6 +578,13 @@ class Stations_organisation:
                     self.folder.input.ground_stations.path, driver="GPKG"
                 )
 
+    @property
+    def stations_df(self):
+        """Stations in the gpkg, read on first use."""
+        if self._stations_df is None:
+            self._stations_df = self.load_stations_gdf()
+        return self._stations_df
+
     def load_stations_gdf(self):
         gdf = gpd.read_file(self.folder.input.ground_stations.path)
         # gdf = gdf[gdf["organisation"].isin(self.organisations)]
@@ -407,20 +595,50 @@ class Stations_organisation:
 
 
 class Stations_combined:
-    """Class that combines the resampled timeseries of all organisations."""
+    """Class that combines the resampled timeseries of all organisations.
+
+    The timeseries are loaded on first use of df_value, df_mask or df_irc
+    (or with load_stations and load_wiwb). Only the stations (ID) and the
+    period between start and end are read.
+
+    With use_cache the combined cube (build_cube) is saved in
+    01_data/p_combined_station and opened memory-mapped by later runs, as long
+    as the input files (gpkg and resampled timeseries) and arguments are
+    unchanged. When the inputs change the cube built from the older inputs with
+    the same arguments is removed, cubes of other arguments are kept."""
 
     def __init__(
-        self, folder, organisations, wiwb_combined, resample_rule, settings_all,
+        self,
+        folder,
+        organisations,
+        wiwb_combined,
+        resample_rule,
+        settings_all,
+        start=None,
+        end=None,
+        stations=None,
+        use_cache=True,
     ):
         self.folder = folder
         self.organisations = organisations
         self.stations_org = {}  # dict with classes of all organisations
         self.stations_df = self.load_stations_gdf()
+        if stations is not None:
+            self.stations_df = self.stations_df[self.stations_df["ID"].isin(stations)]
         self.wiwb_combined = wiwb_combined
         self.resample_rule = resample_rule
         self.settings_all = settings_all
+        self.start = start  # Only load the period between start and end.
+        self.end = end
+        self.cube = None  # timeseries.TimeseriesCube, created by build_cube.
+        self.use_cache = use_cache
+        self._df_value = None
+        self._df_mask = None
+        self._df_irc = None
 
         for organisation in self.organisations:
+            if stations is not None and organisation not in self.stations_df["organisation"].values:
+                continue
             self.stations_org[organisation] = Stations_organisation(
                 folder=self.folder,
                 organisation=organisation,
@@ -433,150 +651,339 @@ class Stations_combined:
         return gdf[gdf["use"] == True]
 
     @staticmethod
-    def merge_df_datetime(dict_df):
+    def merge_df_datetime(dict_df, fill_value=np.nan):
         """Combine all dataframes in a dictionary into one single df."""
-        return reduce(
-            lambda left, right: pd.merge(
-                left, right, left_index=True, right_index=True, how="outer"
-            ),
-            dict_df.values(),
-        )
-
-    def load_stations(self):
-        """Load all stations then combine all dataframes from different organisations into one df. Requires 'self.load' to be run."""
+        return timeseries.align_frames(dict_df, fill_value=fill_value)
 
-        # Load and combine
+    def read_stations(self):
+        """Read the stations of all organisations and combine them into one value and one mask df."""
         dict_values = {}
         dict_mask = {}
         for organisation in self.stations_org:
             stat = self.stations_org[organisation]
-            stat.load(resample_rule=self.resample_rule)
+            stat.load(
+                resample_rule=self.resample_rule,
+                stations=self.stations_df.loc[
+                    self.stations_df["organisation"] == organisation, "ID"
+                ].tolist(),
+                start=self.start,
+                end=self.end,
+            )
 
             dict_values[organisation] = stat.df_value
             dict_mask[organisation] = stat.df_mask
 
-        self.df_value = self.merge_df_datetime(dict_df=dict_values)
-        self.df_mask = self.merge_df_datetime(dict_df=dict_mask)
-        self.df_mask = self.df_mask == True  # Fill nanvalues.
+        df_value = self.merge_df_datetime(dict_df=dict_values)
+        df_mask = self.merge_df_datetime(dict_df=dict_mask, fill_value=False)
+        return df_value, df_mask
 
-    def load_wiwb(self):
-        """Load timeseries of wiwb results at station location"""
+    def load_stations(self):
+        """Load all stations then combine all dataframes from different organisations into one df. Requires 'self.load' to be run."""
+        self._df_value, self._df_mask = self.read_stations()
+        self.cube = None
+
+    @property
+    def df_value(self):
+        if self._df_value is None:
+            self._df_value, self._df_mask = self.read_stations()
+        return self._df_value
 
-        self.df_irc = {}
-        for irc_type in self.wiwb_combined.settings:
-            self.df_irc[irc_type] = pd.read_parquet(
-                self.wiwb_combined.out_path[irc_type][self.resample_rule]
+    @property
+    def df_mask(self):
+        if self._df_mask is None:
+            self._df_value, self._df_mask = self.read_stations()
+        return self._df_mask
+
+    def lazy_wiwb(self) -> LazyFrames:
+        """Timeseries of wiwb results at station location. Every irc type is read
+        on first access."""
+
+        def load(irc_type):
+            return self.wiwb_combined.load(
+                irc_type,
+                resample_rule=self.resample_rule,
+                stations=self.stations_df["WEERGAVENAAM"].tolist(),
+                start=self.start,
+                end=self.end,
             )
 
+        return LazyFrames(load, keys=self.wiwb_combined.settings)
+
+    def load_wiwb(self):
+        """Timeseries of wiwb results at station location. Every irc type is read
+        on first access of df_irc[irc_type]."""
+        self._df_irc = self.lazy_wiwb()
+        self.cube = None
+
+    @property
+    def df_irc(self):
+        if self._df_irc is None:
+            self._df_irc = self.lazy_wiwb()
+        return self._df_irc
+
     @property
     def df(self):
         """filtered table with measured values"""
         return self.df_value[~self.df_mask]
 
-    def get_station(self, row):
-        """Get all timeseries of the station and combine them in one dataframe"""
+    @property
+    def available(self):
+        """Per station in stations_df, True when the station and all irc types have a timeseries."""
+        available = self.stations_df["ID"].isin(self.df_value.columns)
+        for irc_type in self.df_irc:
+            available &= self.stations_df["WEERGAVENAAM"].isin(self.df_irc[irc_type].columns)
+        return available
+
+    def input_paths(self) -> list:
+        """Files and folders the combined timeseries are read from."""
+        paths = [self.folder.input.ground_stations.path]
+        for organisation, stat in self.stations_org.items():
+            if organisation in stat.store.sources:
+                paths.append(stat.store.source_path(organisation, self.resample_rule))
+            else:
+                paths += [
+                    stat.out_path["value"][self.resample_rule],
+                    stat.out_path["mask"][self.resample_rule],
+                ]
+        if self.wiwb_combined is not None:
+            store = self.wiwb_combined.store
+            for irc_type in self.wiwb_combined.settings:
+                if irc_type in store.sources:
+                    paths.append(store.source_path(irc_type, self.resample_rule))
+                else:
+                    paths.append(self.wiwb_combined.out_path[irc_type][self.resample_rule])
+        return [i for i in paths if os.path.exists(i)]
+
+    @property
+    def cache_key(self):
+        """Hash of the arguments of the cube, the same for every version of the inputs."""
+        return ingest_cache.settings_hash(
+            {
+                "organisations": list(self.stations_org),
+                "irc_types": list(self.df_irc),
+                "resample_rule": self.resample_rule,
+                "start": self.start,
+                "end": self.end,
+                "stations": sorted(self.stations_df["ID"]),
+            }
+        )[:16]
+
+    @property
+    def cache_path(self):
+        """Folder of the cached cube, named by the arguments (cache_key) and the
+        fingerprint of the inputs."""
+        inputs = ingest_cache.settings_hash(
+            {
+                "files": [
+                    i for path in self.input_paths() for i in ingest_cache.stat_fingerprint(path)
+                ],
+                "format_version": timeseries.TimeseriesCube.format_version,
+            }
+        )
+        return Path(self.folder.input.paths["station"]["combined"].path) / (
+            f"{self.resample_rule}_{self.cache_key}_{inputs[:16]}"
+        )
+
+    def build_cube(self):
+        """Combine the timeseries of all available stations into one aligned array
+        (time x station x [station, irc types]) and a mask (time x station). The
+        stations are views on these arrays, see timeseries.TimeseriesCube.
+
+        The values keep the (float) dtype of the resampled timeseries. Afterwards
+        the source frames (df_value, df_mask and df_irc) are released, so the
+        timeseries are only held once. They are read again when they are used."""
+        if self.use_cache:
+            cache_path = self.cache_path
+            if (cache_path / "meta.json").exists():
+                try:
+                    self.cube = timeseries.TimeseriesCube.open(cache_path)
+                    return self.cube
+                except FileNotFoundError:
+                    pass  # Removed by another process in the meantime, build it again.
+
         irc_types = [i for i in self.df_irc]
-        dict_station = {}
-        dict_station["station"] = self.df[row["ID"]].rename("station")
+        available = self.available
+        stations_df = self.stations_df[available]
+        frames = [self.df_value] + [self.df_irc[i] for i in irc_types]
+        index = timeseries.union_index(frames)
+        float_dtypes = [
+            dtype
+            for df in frames
+            for dtype in set(df.dtypes)
+            if isinstance(dtype, np.dtype) and dtype.kind == "f"
+        ]
+
+        self.cube = timeseries.TimeseriesCube(
+            index=index,
+            stations=stations_df["ID"],
+            layers=["station"] + irc_types,
+            dtype=np.result_type(np.float32, *float_dtypes),
+        )
+        self.cube.set_layer("station", self.df_value)
         for irc_type in irc_types:
-            dict_station[irc_type] = self.df_irc[irc_type][row["WEERGAVENAAM"]].rename(
-                irc_type
+            self.cube.set_layer(
+                irc_type, self.df_irc[irc_type], columns=stations_df["WEERGAVENAAM"]
             )
-        dict_station["mask"] = self.df_mask[row["ID"]].rename("mask")
-
-        # Combine all dataframes into one.
-        df_timeseries = self.merge_df_datetime(dict_station)
+        self.cube.set_mask(self.df_mask)
+
+        # Stations that are skipped
+        missing = []
+        has_station = self.stations_df["ID"].isin(self.df_value.columns)
+        for row in self.stations_df[~has_station].itertuples():
+            missing.append(f"{row.ID} -- Missing timeseries")
+        for row in self.stations_df[has_station & ~available].itertuples():
+            avail = {key: row.WEERGAVENAAM in self.df_irc[key] for key in self.df_irc}
+            missing.append(f"{row.ID} -- Missing wiwb timeseries \n {avail}")
+        self.cube.attrs = {"irc_types": irc_types, "missing": missing}
+
+        # The cube holds the timeseries now.
+        self._df_value = None
+        self._df_mask = None
+        self._df_irc = None
+
+        if self.use_cache:
+            self.cube.save(cache_path)
+            self.prune_cache(keep=cache_path)
+        return self.cube
+
+    def prune_cache(self, keep):
+        """Remove the cached cubes with the same arguments (cache_key) except keep,
+        these were built from older inputs. Cubes of other arguments (e.g. a
+        single station or period) are kept. Folders that are still being written
+        (.tmp) or cannot be removed (e.g. opened by another process on Windows)
+        are skipped."""
+        for path in Path(keep).parent.glob(f"{self.resample_rule}_{self.cache_key}_*"):
+            if path == Path(keep) or ".tmp" in path.name or not path.is_dir():
+                continue
+            shutil.rmtree(path, ignore_errors=True)
 
+    def get_station(self, row):
+        """Get the station with all its timeseries (a view on the cube)"""
+        if self.cube is None:
+            self.build_cube()
         return Station(
-            self.folder, row, self.resample_rule, df=df_timeseries, irc_types=irc_types
+            self.folder,
+            row,
+            self.resample_rule,
+            irc_types=self.cube.attrs["irc_types"],
+            cube=self.cube,
         )
 
     def __iter__(self):
         """when iterating over 'self' this will yield the station classes."""
-        
-        # Check if all irc items are available
-        # avail = self.stations_df.apply(lambda x: [x['WEERGAVENAAM'] in self.df_irc[key] for key in self.df_irc.keys()], axis=1)
-        for index, row in self.stations_df.iterrows():
-            if row["ID"] in self.df_value.columns:
-                avail = {}
-                for key in self.df_irc.keys():
-                    avail[key] = row["WEERGAVENAAM"] in self.df_irc[key] 
-                
-                if np.all(list(avail.values())):
-                    yield self.get_station(row)
-                else:
-                    print(f"{row['ID']} -- Missing wiwb timeseries \n {avail}")
-            else:
-                print(f"{row['ID']} -- Missing timeseries")
+        if self.cube is None:
+            self.build_cube()
 
+        # Stations without station or irc timeseries
+        for message in self.cube.attrs["missing"]:
+            print(message)
 
+        stations_df = self.stations_df[self.stations_df["ID"].isin(self.cube.stations)]
+        for index, row in stations_df.iterrows():
+            yield self.get_station(row)
 
     def __repr__(self):
         return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
 
 
 class Wiwb_combined:
-    def __init__(self, folder, settings):
+    """Timeseries of the irc products at the station locations.
+
+    source="raw" reads the point downloads in p_raw_wiwb, source="cube" samples
+    the stations from the full grids in p_cube_wiwb (irc_cube.IrcCube)."""
+
+    def __init__(self, folder, settings, source="raw", resample_rules=RESAMPLE_RULES):
         self.folder = folder
         self.settings = settings
+        self.source = source
+        self.resample_rules = resample_rules
 
         self.out_path = self.set_out_path()
+        self.store = ts_store.TimeseriesStore(self.folder.input.paths["wiwb"]["store"].path)
 
     def set_out_path(self):
-
+        """Files per resolution of older versions, only read when the irc type
+        is not in the store."""
         out_path = {}
         for irc_type in self.settings:
             out_path[irc_type] = {}
-            for resample_rule in ["h", "d"]:
+            for resample_rule in self.resample_rules:
+                resample_text = RESAMPLE_TEXT.get(resample_rule, resample_rule)
                 out_path[irc_type][resample_rule] = self.folder.input.paths["wiwb"][
                     "resampled"
-                ].full_path(f"{irc_type}_{RESAMPLE_TEXT[resample_rule]}.parquet")
+                ].full_path(f"{irc_type}_{resample_text}.parquet")
         return out_path
 
     @staticmethod
-    def merge_df_datetime(dict_df):
+    def merge_df_datetime(dict_df, fill_value=np.nan):
         """Combine all dataframes in a dictionary into one single df."""
-        return reduce(
-            lambda left, right: pd.merge(
-                left, right, left_index=True, right_index=True, how="outer"
-            ),
-            dict_df.values(),
+        return timeseries.align_frames(dict_df, fill_value=fill_value)
+
+    def load_raw(self, irc_type):
+        """Load raw values of the point downloads. Files can overlap (e.g. an older
+        download next to the partitions), the most recent file is used."""
+        raw_filepaths = sorted(
+            self.settings[irc_type]["raw_filepaths"], key=os.path.getmtime
         )
+        df_raw = pd.concat([pd.read_parquet(i) for i in raw_filepaths])
+        df_raw = df_raw[~df_raw.index.duplicated(keep="last")]
+        return df_raw.unstack(level=1).droplevel(0, axis=1)
+
+    def load_cube(self, irc_type, start=None, end=None):
+        """Sample the timeseries of all stations in the gpkg from the irc cube."""
+        stations_df = gpd.read_file(self.folder.input.ground_stations.path)
+        stations_df = stations_df[stations_df["use"] == True]
+        points = stations_df.set_index("WEERGAVENAAM")["geometry"].to_dict()
 
-    def resample(self, overwrite=True):
-        """Resample wiwb values to hour and day data. Save to file"""
+        cube = irc_cube.IrcCube(self.folder.input.paths["wiwb"]["cube"].path, irc_type)
+        return cube.sample(points, start=start, end=end)
+
+    def resample(self, overwrite=True, incremental=False):
+        """Resample wiwb values to the resample_rules (default hour and day data).
+        Save to file. See Stations_organisation.resample for incremental."""
 
         for irc_type in self.settings:
             cont = [True]
 
             # First check if all output already exists
-            if overwrite == False:
-                for resample_rule in ["h", "d"]:
-                    if os.path.exists(self.out_path[irc_type][resample_rule]):
-                        cont.append(False)
+            if overwrite == False and incremental == False:
+                if irc_type in self.store.sources:
+                    cont.append(False)
 
             if np.all(cont) == True:
-                # Load raw values
-                df_value_dict = {}
-                for raw_filepath in self.settings[irc_type]["raw_filepaths"]:
-                    df_value_dict[raw_filepath] = (
-                        pd.read_parquet(raw_filepath)
-                        .unstack(level=1)
-                        .droplevel(0, axis=1)
-                    )
+                since = None
+                if incremental:
+                    since = self.store.resume_from(irc_type, self.resample_rules)
 
-                df_value = self.merge_df_datetime(df_value_dict)
+                if self.source == "cube":
+                    df_value = self.load_cube(irc_type, start=since)
+                else:
+                    df_value = self.load_raw(irc_type)
+                if since is not None:
+                    df_value = df_value[df_value.index >= since]
 
-                for resample_rule in ["h", "d"]:
-                    # Resample
-                    df_value_resampled = pd.DataFrame(
-                        df_value.resample(resample_rule).sum()
-                    )
+                # Resample, coarser rules are derived from the finer results.
+                resampled = timeseries.cascade_resample(
+                    df_value, resample_rules=self.resample_rules
+                )
 
-                    # Save to file
-                    df_value_resampled.to_parquet(
-                        self.out_path[irc_type][resample_rule]
-                    )
+                # Save to file
+                if since is None:
+                    self.store.write(irc_type, resampled, replace=True)
+                else:
+                    self.store.update(irc_type, resampled)
+
+    def load(self, irc_type, resample_rule="h", stations=None, start=None, end=None):
+        """Load resampled timeseries of an irc type from file. stations are the
+        names (WEERGAVENAAM) of the stations."""
+        if irc_type in self.store.sources:
+            df_value, _ = self.store.query(
+                irc_type, resample_rule, stations=stations, start=start, end=end
+            )
+            return df_value
+        return ts_store.read_wide(
+            self.out_path[irc_type][resample_rule], columns=stations, start=start, end=end
+        )
 
     def __repr__(self):
         return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
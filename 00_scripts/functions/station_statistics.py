@@ -1,8 +1,54 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import re
 
 
+# Intensity classes of the gauge values per resolution (Station.resample_text),
+# (value, [lower, upper), legend). Resolutions that are not in here are not classified.
+CLASSES = {
+    "1h": [
+        (0, [0, 0.1], "<0.1 mm"),
+        (1, [0.1, 4], "0.1-4 mm"),
+        (2, [4, 99999], ">4 mm"),
+    ],
+    "24h": [
+        (0, [0, 0.1], "<0.1 mm"),
+        (1, [0.1, 5], "0.1-5 mm"),
+        (2, [5, 10], "5-10 mm"),
+        (3, [10, 99999], ">10 mm"),
+    ],
+}
+
+
+def classify(values, classes: pd.DataFrame) -> np.ndarray:
+    """Class value of every value, -1 when it is in none of the classes.
+
+    The class is found with a binned search over the lower edges of the
+    classes, so all values are classified in one call.
+
+    Parameters
+    ----------
+    values : array-like
+    classes : pd.DataFrame
+        table of StationStats.create_classes, "range" is [lower, upper).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if classes.empty:
+        return np.full(values.shape, -1, dtype=np.int64)
+
+    lower = classes["range"].str[0].to_numpy(dtype=np.float64)
+    order = np.argsort(lower)
+    lower = lower[order]
+    upper = classes["range"].str[1].to_numpy(dtype=np.float64)[order]
+    class_values = classes["value"].to_numpy(dtype=np.int64)[order]
+
+    i = np.searchsorted(lower, values, side="right") - 1
+    valid = i >= 0
+    valid[valid] = values[valid] < upper[i[valid]]
+    return np.where(valid, class_values[np.maximum(i, 0)], -1)
+
+
 class IrcStats:
     """Statistics per irc type"""
 
@@ -33,10 +79,118 @@ class IrcStats:
 
         self.RelBiasTotalCumu = round(self.BiasTotalCumu / self.gauge_cumu * 100, 1)
 
+        self.class_stats = self.get_class_stats()
+
+    def get_class_stats(self):
+        """Bias and stdev of the residuals per intensity class of the gauge."""
+        classes = self.stationstats.classes.set_index("value")
+        grouped = self.residuals.groupby(self.stationstats.df["class"])
+        class_stats = pd.DataFrame(
+            {
+                "n": grouped.count(),
+                "gauge_mean": self.gauge.groupby(self.stationstats.df["class"]).mean(),
+                "BiasTotal": grouped.mean(),
+                "stdev": grouped.std().round(2),
+            }
+        ).reindex(classes.index)
+        class_stats["n"] = class_stats["n"].fillna(0).astype(int)
+        class_stats["RelBiasTotal"] = (
+            class_stats["BiasTotal"] / class_stats["gauge_mean"] * 100
+        ).round(1).where(class_stats["gauge_mean"] != 0, 0)
+        class_stats.insert(0, "legend", classes["legend"])
+        return class_stats
+
     def __repr__(self):
         return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
 
 
+def network_stats(cube, irc_types=None) -> pd.DataFrame:
+    """Statistics of IrcStats for all stations and irc types of a combined cube at
+    once (timeseries.TimeseriesCube of Stations_combined.build_cube).
+
+    The timesteps that StationStats uses (all layers have a value, gauge >= 0
+    and not masked) are selected with one boolean array, the statistics are
+    masked reductions over the time axis of the cube.
+
+    Parameters
+    ----------
+    cube : timeseries.TimeseriesCube
+        layers "station" and the irc types, with the mask
+    irc_types : list, optional
+        defaults to the irc types of the cube.
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per station (ID) and irc_type. Stations without any usable
+        timestep have nan statistics (StationStats raises for those).
+    """
+    if irc_types is None:
+        irc_types = cube.attrs["irc_types"]
+    values = cube.values
+    layers = cube.layers
+
+    # Same selection as StationStats.get_df_yesdata, (time x station)
+    gauge = values[:, :, layers.get_loc("station")]
+    yesdata = ~np.isnan(values).any(axis=2) & (gauge >= 0) & ~cube.mask
+    n = yesdata.sum(axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Skipped timesteps are 0, so the sums only run over the selected ones.
+        # The statistics are computed in float64, also for a float32 cube.
+        gauge = np.where(yesdata, gauge, 0).astype(np.float64)
+        gauge_cumu = gauge.sum(axis=0)
+        gauge_mean = gauge_cumu / n
+        gauge_dev = np.where(yesdata, gauge - gauge_mean, 0)
+        gauge_ss = (gauge_dev**2).sum(axis=0)
+        CV = np.where(gauge_mean == 0, 0, np.round(np.sqrt(gauge_ss / (n - 1)) / gauge_mean, 2))
+
+        stats = []
+        for irc_type in irc_types:
+            irc = np.where(yesdata, values[:, :, layers.get_loc(irc_type)], 0).astype(np.float64)
+            residuals = irc - gauge
+            irc_cumu = irc.sum(axis=0)
+            irc_mean = irc_cumu / n
+            BiasTotal = residuals.sum(axis=0) / n
+            BiasTotalCumu = irc_cumu - gauge_cumu
+
+            # Deviations from the mean, ddof=1 like pandas.
+            irc_dev = np.where(yesdata, irc - irc_mean, 0)
+            residuals_dev = np.where(yesdata, residuals - BiasTotal, 0)
+            corr = (gauge_dev * irc_dev).sum(axis=0) / np.sqrt(gauge_ss * (irc_dev**2).sum(axis=0))
+            stdev = np.sqrt((residuals_dev**2).sum(axis=0) / (n - 1))
+
+            stats.append(
+                pd.DataFrame(
+                    {
+                        "ID": cube.stations,
+                        "irc_type": irc_type,
+                        "n": n,
+                        "gauge_mean": gauge_mean,
+                        "irc_mean": irc_mean,
+                        "BiasTotal": BiasTotal,
+                        "RelBiasTotal": np.where(
+                            gauge_mean == 0, 0, np.round(BiasTotal / gauge_mean * 100, 1)
+                        ),
+                        "gauge_cumu": gauge_cumu,
+                        "irc_cumu": irc_cumu,
+                        "BiasTotalCumu": BiasTotalCumu,
+                        "RelBiasTotalCumu": np.round(BiasTotalCumu / gauge_cumu * 100, 1),
+                        "corr": np.round(corr, 2),
+                        "stdev": np.round(stdev, 2),
+                        "CV": CV,
+                    }
+                )
+            )
+
+    if not stats:
+        return pd.DataFrame(columns=["ID", "irc_type", "n"])
+    stats = pd.concat(stats, ignore_index=True)
+    # No usable timesteps
+    stats.loc[stats["n"] == 0, stats.columns[3:]] = np.nan
+    return stats
+
+
 class StationStats:
     """Statistics calculation for a station with timeseries already loaded.
     self.df is the table with all relevant timeseries
@@ -55,7 +209,7 @@ class StationStats:
 
         # Classify the station timeseries
         self.classes = self.create_classes()
-        self.df["class"] = self.df["station"].apply(self.classify_ts)
+        self.df["class"] = classify(self.df["station"], self.classes)
 
         # Statistics
         self.irc_stats = {}
@@ -171,27 +325,15 @@ class StationStats:
         return ax
 
     def create_classes(self):
-        """Table used to classify the station p values"""
-        classes = pd.DataFrame(columns=["value", "range", "legend"])
-
-        if self.station.resample_text == "1h":
-            classes.loc[len(classes)] = [0, [0, 0.1], "<0.1 mm"]
-            classes.loc[len(classes)] = [1, [0.1, 4], "0.1-4 mm"]
-            classes.loc[len(classes)] = [2, [4, 99999], ">4 mm"]
-
-        elif self.station.resample_text == "24h":
-            classes.loc[len(classes)] = [0, [0, 0.1], "<0.1 mm"]
-            classes.loc[len(classes)] = [1, [0.1, 5], "0.1-5 mm"]
-            classes.loc[len(classes)] = [2, [5, 10], "5-10 mm"]
-            classes.loc[len(classes)] = [3, [10, 99999], ">10 mm"]
-        return classes
+        """Table used to classify the station p values, see CLASSES."""
+        return pd.DataFrame(
+            CLASSES.get(self.station.resample_text, []), columns=["value", "range", "legend"]
+        )
 
     def classify_ts(self, x):
         """Return the value of the class based on measured value"""
-        for index, row in self.classes.iterrows():
-            if row["range"][0] <= x and x < row["range"][1]:
-                return row["value"]  # index value
-        return None
+        value = classify([x], self.classes)[0]
+        return None if value == -1 else value
 
     def get_df_yesdata(self):
         """Check if any input table has nodata, values are True when there is a value"""
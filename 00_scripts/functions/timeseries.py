@@ -0,0 +1,371 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def union_index(frames: list) -> pd.Index:
+    """Sorted union of the indexes of all frames, computed in one step."""
+    index = frames[0].index
+    if len(frames) > 1:
+        index = index.append([frame.index for frame in frames[1:]])
+    return index.unique().sort_values()
+
+
+def _aligned_dtype(dtype, fill_value):
+    """dtype of a column after alignment. Missing rows are filled with fill_value,
+    the dtype is only changed when it cannot hold fill_value. Bool columns then
+    become the nullable boolean dtype instead of object."""
+    if isinstance(dtype, pd.BooleanDtype):
+        return dtype if pd.isna(fill_value) else np.dtype(bool)
+    if not isinstance(dtype, np.dtype):
+        return np.dtype(object)  # e.g. category
+    if pd.isna(fill_value):
+        if dtype == bool:
+            return pd.BooleanDtype()
+        if np.issubdtype(dtype, np.integer):
+            return np.dtype("float64")
+        return dtype
+    if dtype == bool and not isinstance(fill_value, (bool, np.bool_)):
+        return np.dtype(object)
+    return dtype
+
+
+def merge_columns(frames: list) -> list:
+    """Column names of every frame after merging the frames one by one with an
+    outer pd.merge: a name that is already in the merged frame gets the suffix
+    _x there and _y in the frame that is added.
+
+    Returns
+    -------
+    list[list]
+        names of the columns of every frame.
+
+    Raises
+    ------
+    ValueError
+        When the names are still not unique after adding the suffixes (pd.merge
+        fails as well).
+    """
+    merged = []  # (frame, name) of all columns that are merged so far
+    for i, df in enumerate(frames):
+        names = list(df.columns)
+        overlap = {name for _, name in merged} & set(names)
+        if overlap:
+            merged = [(j, f"{name}_x" if name in overlap else name) for j, name in merged]
+            names = [f"{name}_y" if name in overlap else name for name in names]
+        merged += [(i, name) for name in names]
+
+        columns = pd.Index([name for _, name in merged])
+        if columns.has_duplicates:
+            raise ValueError(f"Duplicate columns: {list(columns[columns.duplicated()].unique())}")
+
+    return [[name for j, name in merged if j == i] for i in range(len(frames))]
+
+
+def align_frames(dict_df: dict, fill_value=np.nan) -> pd.DataFrame:
+    """Combine all dataframes (or series) in a dictionary into one single df with
+    the union of their (datetime) indexes. Same result as an outer merge on the
+    index, but the union index is created once and every column is placed into
+    it with a single allocation per dtype.
+
+    Parameters
+    ----------
+    dict_df : dict[str:pd.DataFrame | pd.Series]
+        frames with a unique index. Like pd.merge, a column that is in more than
+        one frame gets the suffixes _x and _y (see merge_columns).
+    fill_value : scalar
+        value of rows that are missing in a frame.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    frames = [df.to_frame() if isinstance(df, pd.Series) else df for df in dict_df.values()]
+    if not frames:
+        return pd.DataFrame()
+    frames = [df for df in frames if len(df.columns) > 0] or frames[:1]
+
+    names = merge_columns(frames)
+    columns = pd.Index([name for frame_names in names for name in frame_names])
+
+    index = union_index(frames)
+    indexers = [index.get_indexer(df.index) for df in frames]
+
+    # Columns per dtype, in order of appearance
+    groups = {}
+    for i, df in enumerate(frames):
+        for j, dtype in enumerate(df.dtypes):
+            groups.setdefault(_aligned_dtype(dtype, fill_value), []).append((i, j))
+
+    blocks = []
+    for dtype, cols in groups.items():
+        if isinstance(dtype, pd.BooleanDtype):
+            values = np.zeros((len(index), len(cols)), dtype=bool)
+            missing = np.ones((len(index), len(cols)), dtype=bool)
+        else:
+            fill = fill_value
+            if dtype.kind in "mM" and pd.isna(fill_value):
+                fill = np.datetime64("NaT")
+            values = np.full((len(index), len(cols)), fill, dtype=dtype)
+            missing = None
+
+        for k, (i, j) in enumerate(cols):
+            column = frames[i].iloc[:, j]
+            if missing is not None:
+                missing[indexers[i], k] = column.isna().to_numpy()
+                column = column.fillna(False)
+            values[indexers[i], k] = column.to_numpy(dtype=values.dtype)
+
+        block_columns = [names[i][j] for i, j in cols]
+        if missing is not None:
+            blocks.append(
+                pd.DataFrame(
+                    {
+                        col: pd.arrays.BooleanArray(values[:, k], missing[:, k])
+                        for k, col in enumerate(block_columns)
+                    },
+                    index=index,
+                )
+            )
+        else:
+            blocks.append(pd.DataFrame(values, index=index, columns=block_columns, copy=False))
+
+    if len(blocks) == 1:
+        df = blocks[0]
+    else:
+        df = pd.concat(blocks, axis=1)[columns]
+    df.columns.name = frames[0].columns.name
+    return df
+
+
+def interval_mask(index: pd.DatetimeIndex, columns, intervals: list) -> np.ndarray:
+    """Boolean array (index x columns) that is True within the intervals.
+
+    All intervals are written into a difference array with np.add.at and
+    summed once along the time axis, so the cost does not depend on the
+    number of intervals per column.
+
+    Parameters
+    ----------
+    index : pd.DatetimeIndex
+        sorted datetime index of the mask.
+    columns : list-like
+        columns of the mask.
+    intervals : list[tuple[column, start, end]]
+        masked period [start, end) of a column. start or end None is unbounded.
+        Intervals of columns that are not in columns are ignored.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if not index.is_monotonic_increasing:
+        raise ValueError("Index must be sorted to create an interval mask.")
+    columns = pd.Index(columns)
+    n = len(index)
+
+    col, i0, i1 = [], [], []
+    for column, start, end in intervals:
+        j = columns.get_indexer([column])[0]
+        if j == -1:
+            continue
+        col.append(j)
+        i0.append(0 if start is None else index.searchsorted(start, side="left"))
+        i1.append(n if end is None else index.searchsorted(end, side="left"))
+
+    diff = np.zeros((n + 1, len(columns)), dtype=np.int32)
+    if col:
+        col = np.array(col)
+        i0 = np.array(i0)
+        i1 = np.maximum(np.array(i1), i0)
+        np.add.at(diff, (i0, col), 1)
+        np.add.at(diff, (i1, col), -1)
+    return np.cumsum(diff[:n], axis=0) > 0
+
+
+def pandas_rule(resample_rule: str) -> str:
+    """Resample rule as passed to pandas. The day alias "d" of the repo is
+    deprecated in pandas, it is passed as "D"."""
+    if resample_rule.endswith("d"):
+        resample_rule = f"{resample_rule[:-1]}D"
+    return resample_rule
+
+
+def rule_timedelta(resample_rule: str) -> pd.Timedelta:
+    """Duration of a resample rule, e.g. "h" -> 1 hour, "5min" -> 5 minutes."""
+    resample_rule = pandas_rule(resample_rule)
+    if not resample_rule[0].isdigit():
+        resample_rule = f"1{resample_rule}"
+    return pd.to_timedelta(resample_rule)
+
+
+def cascade_resample(df_value: pd.DataFrame, df_mask: pd.DataFrame = None, resample_rules=("h", "d")) -> dict:
+    """Resample to several resolutions, aggregating the raw data only once.
+
+    The raw data is resampled to the finest rule, every coarser rule is
+    resampled from the finest result it is a multiple of. Values are summed,
+    a resampled timestep is masked when any of the underlying timesteps is
+    masked.
+
+    Parameters
+    ----------
+    df_value : pd.DataFrame
+        values with a datetime index.
+    df_mask : pd.DataFrame, optional
+        bool mask with the same index as df_value.
+    resample_rules : list[str]
+        pandas resample rules, e.g. ["5min", "h", "3h", "d"]
+
+    Returns
+    -------
+    dict[str:tuple[pd.DataFrame, pd.DataFrame]]
+        (value, mask) per resample rule. mask is None without df_mask.
+    """
+    resampled = {}
+    for resample_rule in sorted(resample_rules, key=rule_timedelta):
+        step = rule_timedelta(resample_rule)
+
+        # Coarsest finer result that fits a whole number of times in this rule.
+        source_value, source_mask = df_value, df_mask
+        for finer_rule in sorted(resampled, key=rule_timedelta):
+            if step % rule_timedelta(finer_rule) == pd.Timedelta(0):
+                source_value, source_mask = resampled[finer_rule]
+
+        df_value_resampled = source_value.resample(pandas_rule(resample_rule)).sum()
+        df_mask_resampled = None
+        if source_mask is not None:
+            df_mask_resampled = source_mask.resample(pandas_rule(resample_rule)).sum() != 0
+        resampled[resample_rule] = (df_value_resampled, df_mask_resampled)
+    return {resample_rule: resampled[resample_rule] for resample_rule in resample_rules}
+
+
+class TimeseriesCube:
+    """Aligned timeseries of several stations and layers (e.g. gauge and irc
+    products) in one array of shape (time, station, layer), with a bool mask
+    of shape (time, station).
+
+    The values keep the dtype of the source timeseries (float32 for the
+    store), the mask is stored as bool. frame(station) returns a DataFrame
+    that is a view on the arrays, so a station does not hold a copy of its
+    timeseries. A saved cube is opened memory-mapped (open), so it is not read
+    into memory and can be shared by several processes.
+
+    Parameters
+    ----------
+    index : pd.DatetimeIndex
+        time axis
+    stations : list
+        station axis
+    layers : list
+        layer axis
+    dtype : np.dtype
+        float dtype of the values.
+    """
+
+    format_version = 2  # Changes when the saved layout changes.
+
+    def __init__(self, index, stations, layers, dtype=np.float32):
+        self.index = pd.DatetimeIndex(index)
+        self.stations = pd.Index(stations)
+        self.layers = pd.Index(layers)
+        self.values = np.full(
+            (len(self.index), len(self.stations), len(self.layers)), np.nan, dtype=dtype
+        )
+        # True where the station value should not be used, also where it is missing.
+        self.mask = np.ones((len(self.index), len(self.stations)), dtype=bool)
+        self.attrs = {}  # json serializable metadata, saved with the cube.
+
+    def _positions(self, df, columns):
+        """Rows of df in the cube and positions of the stations in df."""
+        if columns is None:
+            columns = self.stations
+        rows = self.index.get_indexer(df.index)
+        cols = df.columns.get_indexer(columns)
+        return rows, cols
+
+    def set_layer(self, layer, df: pd.DataFrame, columns=None):
+        """Place a wide frame (time x station) in a layer.
+
+        Parameters
+        ----------
+        layer : str
+        df : pd.DataFrame
+            datetime index and a column per station.
+        columns : list, optional
+            column of df for every station, defaults to the station names.
+        """
+        k = self.layers.get_loc(layer)
+        rows, cols = self._positions(df, columns)
+        valid_rows = rows >= 0
+        valid_cols = cols >= 0
+
+        data = df.iloc[valid_rows, cols[valid_cols]].to_numpy(
+            dtype=self.values.dtype, na_value=np.nan
+        )
+        self.values[np.ix_(rows[valid_rows], np.flatnonzero(valid_cols), [k])] = data[:, :, None]
+
+    def set_mask(self, df: pd.DataFrame, columns=None):
+        """Place a wide bool frame (time x station) in the mask. Timesteps and
+        stations that are not in df stay masked."""
+        rows, cols = self._positions(df, columns)
+        valid_rows = rows >= 0
+        valid_cols = cols >= 0
+
+        data = df.iloc[valid_rows, cols[valid_cols]].to_numpy(dtype=bool, na_value=True)
+        self.mask[np.ix_(rows[valid_rows], np.flatnonzero(valid_cols))] = data
+
+    def frame(self, station) -> pd.DataFrame:
+        """Timeseries of all layers and the mask of a station, a view on the arrays."""
+        i = self.stations.get_loc(station)
+        df = pd.DataFrame(self.values[:, i, :], index=self.index, columns=self.layers, copy=False)
+        df["mask"] = self.mask[:, i]
+        return df
+
+    def save(self, path):
+        """Save as values.npy, mask.npy, index.npy and meta.json in the folder path.
+        The folder is written next to path and then renamed, so it is never read
+        half written."""
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        tmp_path.mkdir(parents=True)
+        np.save(tmp_path / "values.npy", self.values)
+        np.save(tmp_path / "mask.npy", self.mask)
+        np.save(tmp_path / "index.npy", self.index.values)
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump(
+                {
+                    "format_version": self.format_version,
+                    "stations": self.stations.tolist(),
+                    "layers": self.layers.tolist(),
+                    "attrs": self.attrs,
+                },
+                f,
+            )
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path)  # Saved by another process in the meantime.
+
+    @classmethod
+    def open(cls, path, mmap_mode="r"):
+        """Open a saved cube, the values and mask are memory-mapped."""
+        path = Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != cls.format_version:
+            raise ValueError(f"{path} is saved in an older format, build the cube again.")
+        cube = cls.__new__(cls)
+        cube.index = pd.DatetimeIndex(np.load(path / "index.npy"))
+        cube.stations = pd.Index(meta["stations"])
+        cube.layers = pd.Index(meta["layers"])
+        cube.attrs = meta["attrs"]
+        cube.values = np.load(path / "values.npy", mmap_mode=mmap_mode)
+        cube.mask = np.load(path / "mask.npy", mmap_mode=mmap_mode)
+        return cube
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
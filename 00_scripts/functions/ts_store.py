@@ -0,0 +1,311 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import functions.timeseries as timeseries
+
+
+# Long format of the resampled timeseries, one row per timestep and station.
+# Station is dictionary encoded, parquet stores the bool mask bit-packed.
+SCHEMA = pa.schema(
+    [
+        ("datetime", pa.timestamp("ns")),
+        ("station", pa.dictionary(pa.int32(), pa.string())),
+        ("value", pa.float32()),
+        ("mask", pa.bool_()),
+    ]
+)
+
+
+def to_table(df_value: pd.DataFrame, df_mask: pd.DataFrame = None) -> pa.Table:
+    """Long table of a wide value (and mask) frame with datetime index and a column per station.
+    Without df_mask the mask is False."""
+    n_time, n_station = df_value.shape
+    n = n_time * n_station
+
+    if df_mask is None:
+        mask = np.zeros(n, dtype=bool)
+    else:
+        mask = df_mask.reindex(index=df_value.index, columns=df_value.columns).to_numpy(dtype=bool).ravel()
+
+    return pa.table(
+        {
+            "datetime": pa.array(
+                np.repeat(df_value.index.values.astype("datetime64[ns]"), n_station)
+            ),
+            "station": pa.DictionaryArray.from_arrays(
+                np.tile(np.arange(n_station, dtype=np.int32), n_time),
+                pa.array(df_value.columns.astype(str)),
+            ),
+            "value": df_value.to_numpy(dtype=np.float32).ravel(),
+            "mask": mask,
+        },
+        schema=SCHEMA,
+    )
+
+
+def to_frames(table: pa.Table) -> tuple:
+    """Wide value and mask frame (datetime x station) of a long table. Missing combinations are nan in the values and True in the mask."""
+    if table.num_rows == 0:
+        return pd.DataFrame(dtype=np.float32), pd.DataFrame(dtype=bool)
+
+    station = table.unify_dictionaries().column("station").combine_chunks()
+    if isinstance(station.type, pa.DictionaryType):
+        codes = station.indices.to_numpy(zero_copy_only=False)
+        names = np.asarray(station.dictionary.to_pylist(), dtype=object)
+    else:
+        names, codes = np.unique(station.to_numpy(zero_copy_only=False), return_inverse=True)
+    used = np.unique(codes)
+    col = np.searchsorted(used, codes)
+
+    datetime = table.column("datetime").to_numpy()
+    index = np.unique(datetime)
+    row = np.searchsorted(index, datetime)
+
+    values = np.full((len(index), len(used)), np.nan, dtype=np.float32)
+    values[row, col] = table.column("value").to_numpy(zero_copy_only=False)
+    mask = np.ones((len(index), len(used)), dtype=bool)
+    mask[row, col] = table.column("mask").to_numpy(zero_copy_only=False)
+
+    index = pd.DatetimeIndex(index, name="datetime")
+    columns = pd.Index(names[used], dtype=object)
+    return (
+        pd.DataFrame(values, index=index, columns=columns),
+        pd.DataFrame(mask, index=index, columns=columns),
+    )
+
+
+def read_wide(path, columns=None, start=None, end=None) -> pd.DataFrame:
+    """Read a wide parquet file (datetime index and a column per station) of older
+    versions. Only the columns and the period that are given are read.
+
+    Parameters
+    ----------
+    path : str
+        parquet file
+    columns : list, optional
+        stations to read, stations that are not in the file are skipped.
+    start, end : datetime, optional
+        only read timesteps within [start, end]
+    """
+    schema = pq.read_schema(path)
+    index_columns = [i for i in schema.pandas_metadata["index_columns"] if isinstance(i, str)]
+
+    if columns is not None:
+        columns = [i for i in map(str, columns) if i in schema.names]
+    filters = []
+    if start is not None:
+        filters.append((index_columns[0], ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append((index_columns[0], "<=", pd.Timestamp(end)))
+    return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+
+class TimeseriesStore:
+    """Partitioned store with the resampled timeseries of several sources
+    (organisations or irc products) in the long format of SCHEMA:
+        {folder}/source={source}/resample_rule={resample_rule}/month={YYYY-MM}/part-0.parquet
+
+    Within a partition the rows are sorted by station and time, so the row
+    group statistics can be used to skip stations and timesteps. query only
+    reads the partitions of the source, resolution and months that are asked.
+
+    Parameters
+    ----------
+    folder : str
+        root folder of the store (e.g. 01_data/p_store_station)
+    row_group_size : int
+        maximum number of rows per row group.
+    """
+
+    def __init__(self, folder, row_group_size=2**16):
+        self.folder = Path(folder)
+        self.row_group_size = row_group_size
+
+    @property
+    def sources(self) -> list:
+        if not self.folder.exists():
+            return []
+        return sorted(i.name.split("=", 1)[1] for i in self.folder.glob("source=*"))
+
+    def source_path(self, source, resample_rule=None) -> Path:
+        path = self.folder / f"source={source}"
+        if resample_rule is not None:
+            path = path / f"resample_rule={resample_rule}"
+        return path
+
+    def partition_path(self, source, resample_rule, month) -> Path:
+        return self.source_path(source, resample_rule) / f"month={month}" / "part-0.parquet"
+
+    def months(self, source, resample_rule) -> list:
+        path = self.source_path(source, resample_rule)
+        if not path.exists():
+            return []
+        return sorted(i.name.split("=", 1)[1] for i in path.glob("month=*"))
+
+    def write(self, source, resampled: dict, replace=False):
+        """Write resampled timeseries of a source. Every month in the data replaces
+        the existing partition of that month.
+
+        Parameters
+        ----------
+        source : str
+            organisation or irc type
+        resampled : dict[str:tuple[pd.DataFrame, pd.DataFrame]]
+            (value, mask) per resample rule, see timeseries.cascade_resample.
+        replace : bool
+            remove all existing partitions of the source first.
+        """
+        if replace and self.source_path(source).exists():
+            shutil.rmtree(self.source_path(source))
+
+        for resample_rule, (df_value, df_mask) in resampled.items():
+            months = df_value.index.strftime("%Y-%m")
+            for month in pd.unique(months):
+                rows = months == month
+                self.write_partition(
+                    source,
+                    resample_rule,
+                    month,
+                    df_value[rows],
+                    None if df_mask is None else df_mask[rows],
+                )
+
+    def update(self, source, resampled: dict):
+        """Merge resampled timeseries into the store from the first timestep of the
+        data onwards. Partitions of earlier months are not touched, of the first
+        month the stored timesteps before the data are kept.
+
+        Parameters
+        ----------
+        source : str
+            organisation or irc type
+        resampled : dict[str:tuple[pd.DataFrame, pd.DataFrame]]
+            (value, mask) per resample rule, see timeseries.cascade_resample.
+        """
+        for resample_rule, (df_value, df_mask) in resampled.items():
+            if df_value.empty:
+                continue
+            if df_mask is None:
+                df_mask = pd.DataFrame(False, index=df_value.index, columns=df_value.columns)
+
+            first = df_value.index[0]
+            months = df_value.index.strftime("%Y-%m")
+            for month in pd.unique(months):
+                rows = months == month
+                df_value_month = df_value[rows]
+                df_mask_month = df_mask[rows]
+
+                path = self.partition_path(source, resample_rule, month)
+                if month == first.strftime("%Y-%m") and path.exists():
+                    df_value_old, df_mask_old = to_frames(pq.read_table(path))
+                    keep = df_value_old.index < first
+                    df_value_month = pd.concat([df_value_old[keep], df_value_month])
+                    # Stations that are missing in one of both are masked.
+                    df_mask_month = (
+                        pd.concat([df_mask_old[keep], df_mask_month])
+                        .reindex(columns=df_value_month.columns)
+                        .fillna(True)
+                        .astype(bool)
+                    )
+                self.write_partition(source, resample_rule, month, df_value_month, df_mask_month)
+
+    def resume_from(self, source, resample_rules):
+        """First timestep that has to be resampled again to bring the source up to
+        date, None when a resolution is not in the store yet.
+
+        The last stored timestep of every resolution can be a partial bin, so the
+        earliest of those is used, floored to the coarsest rule. From there the
+        bins of all resolutions are complete again. The rules must divide a day
+        (e.g. 5min, h, 3h, d), so the bins are aligned to midnight.
+        """
+        last = [self.last_timestamp(source, resample_rule) for resample_rule in resample_rules]
+        if not last or any(i is None for i in last):
+            return None
+        coarsest = max(resample_rules, key=timeseries.rule_timedelta)
+        return min(last).floor(timeseries.rule_timedelta(coarsest))
+
+    def write_partition(self, source, resample_rule, month, df_value, df_mask=None):
+        """Write a single month, sorted by station and time."""
+        table = to_table(df_value, df_mask)
+        n_time, n_station = df_value.shape
+        # Rows of to_table are time major, take them station major.
+        order = np.arange(n_time * n_station).reshape(n_time, n_station).T.ravel()
+        table = table.take(order)
+
+        path = self.partition_path(source, resample_rule, month)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_size)
+        os.replace(tmp_path, path)  # Readers never see a partially written file.
+
+    def query(self, source, resample_rule, stations=None, start=None, end=None) -> tuple:
+        """Value and mask frame of a source and resolution.
+
+        Parameters
+        ----------
+        source : str
+            organisation or irc type
+        resample_rule : str
+            e.g. "h"
+        stations : list, optional
+            only read these stations (ID or irc location name)
+        start, end : datetime, optional
+            only read timesteps within [start, end]
+
+        Returns
+        -------
+        tuple[pd.DataFrame, pd.DataFrame]
+            float32 values and bool mask with datetime index and a column per station.
+        """
+        path = self.source_path(source, resample_rule)
+        if not path.exists():
+            return to_frames(SCHEMA.empty_table())
+
+        dataset = ds.dataset(
+            path,
+            format="parquet",
+            schema=SCHEMA.append(pa.field("month", pa.string())),
+            partitioning=ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+        )
+
+        expression = None
+        if start is not None:
+            start = pd.Timestamp(start)
+            expression = (ds.field("month") >= start.strftime("%Y-%m")) & (
+                ds.field("datetime") >= pa.scalar(start.to_pydatetime(), pa.timestamp("ns"))
+            )
+        if end is not None:
+            end = pd.Timestamp(end)
+            end_expression = (ds.field("month") <= end.strftime("%Y-%m")) & (
+                ds.field("datetime") <= pa.scalar(end.to_pydatetime(), pa.timestamp("ns"))
+            )
+            expression = end_expression if expression is None else expression & end_expression
+        if stations is not None:
+            station_expression = pc.is_in(
+                ds.field("station"), value_set=pa.array([str(i) for i in stations])
+            )
+            expression = station_expression if expression is None else expression & station_expression
+
+        table = dataset.to_table(columns=["datetime", "station", "value", "mask"], filter=expression)
+        return to_frames(table)
+
+    def last_timestamp(self, source, resample_rule):
+        """Last stored timestep of a source and resolution, None when empty."""
+        months = self.months(source, resample_rule)
+        if not months:
+            return None
+        table = pq.read_table(
+            self.partition_path(source, resample_rule, months[-1]), columns=["datetime"]
+        )
+        return pd.Timestamp(pc.max(table.column("datetime")).as_py())
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
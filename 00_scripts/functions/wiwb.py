@@ -1,8 +1,12 @@
 from datetime import timedelta, datetime
 import pandas as pd
-from wiwb_downloader import GridDownloader #pip install git+https://gitlab.com/hetwaterschapshuis/kenniscentrum/information-retrieval/wiwb-downloader
+try:
+    from wiwb_downloader import GridDownloader #pip install git+https://gitlab.com/hetwaterschapshuis/kenniscentrum/information-retrieval/wiwb-downloader
+except ImportError:
+    GridDownloader = None  # Only the offline stand-in (functions/wiwb_local.py) can be used.
 import numpy as np
 import geopandas as gpd
+from shapely.strtree import STRtree
 
 def format_datetime(value: datetime) -> str:
     """Format datetime into string to use in wiwb download.
@@ -40,7 +44,183 @@ def get_points_from_gdf(locs):
 #     return locs.set_index("WEERGAVENAAM")["ID"].to_dict()
 
 
-def add_columns_for_points(df: pd.DataFrame, cells: dict, points: dict):
+class NoDataError(ValueError):
+    """The wiwb returned no data for the requested period and extent."""
+
+
+class CellIndex:
+    """Point-to-cell lookup for the cells returned by the GridDownloader.
+
+    The IRC grid is regular, so the cell of a point can be computed from its
+    coordinates. When the cells do not form a regular grid an STRtree is used
+    as fallback. Lookups are cached per set of points.
+
+    Parameters
+    ----------
+    cells : dict[str:Polygon]
+        The cell names with their corresponding shapely polygons.
+    """
+
+    def __init__(self, cells: dict):
+        self.names = list(cells.keys())
+        self.geometries = list(cells.values())
+        self.regular = self._init_regular_grid()
+        self.tree = None
+        self._lookup_cache = {}
+
+    def _init_regular_grid(self) -> bool:
+        """Derive origin, cell size and shape of the grid. Returns False when the
+        cells do not form a regular grid."""
+        bounds = np.array([geom.bounds for geom in self.geometries])
+        if len(bounds) == 0:
+            return False
+        dx = bounds[:, 2] - bounds[:, 0]
+        dy = bounds[:, 3] - bounds[:, 1]
+        if not (np.allclose(dx, dx[0]) and np.allclose(dy, dy[0])):
+            return False
+        # Polygons that are not boxes cannot be looked up arithmetically
+        if not all(np.isclose(geom.area, dx[0] * dy[0]) for geom in self.geometries):
+            return False
+
+        self.dx = dx[0]
+        self.dy = dy[0]
+        self.xmin = bounds[:, 0].min()
+        self.ymax = bounds[:, 3].max()
+
+        cols = np.rint((bounds[:, 0] - self.xmin) / self.dx).astype(int)
+        rows = np.rint((self.ymax - bounds[:, 3]) / self.dy).astype(int)
+        if not (
+            np.allclose(cols * self.dx + self.xmin, bounds[:, 0])
+            and np.allclose(self.ymax - rows * self.dy, bounds[:, 3])
+        ):
+            return False
+
+        self.nrows = rows.max() + 1
+        self.ncols = cols.max() + 1
+        self.rows = rows
+        self.cols = cols
+
+        # Position of every cell in self.names, -1 where the grid has no cell.
+        self.grid = np.full((self.nrows, self.ncols), -1, dtype=np.int64)
+        self.grid[rows, cols] = np.arange(len(self.names))
+        return True
+
+    def _lookup_regular(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # Cells are half-open [xmin, xmax), a point on an edge gets the next
+        # cell, the same cell as in irc_cube.IrcCube.sample.
+        col = np.floor((x - self.xmin) / self.dx).astype(int)
+        row = np.floor((self.ymax - y) / self.dy).astype(int)
+        inside = (col >= 0) & (col < self.ncols) & (row >= 0) & (row < self.nrows)
+        positions = np.full(len(x), -1, dtype=np.int64)
+        positions[inside] = self.grid[row[inside], col[inside]]
+        return positions
+
+    def _lookup_tree(self, geometries: list) -> np.ndarray:
+        if self.tree is None:
+            self.tree = STRtree(self.geometries)
+        positions = np.full(len(geometries), -1, dtype=np.int64)
+        point_idx, cell_idx = self.tree.query(geometries, predicate="intersects")
+        # A point on a cell edge intersects several cells, keep the first one.
+        order = np.lexsort((cell_idx, point_idx))
+        point_idx, cell_idx = point_idx[order], cell_idx[order]
+        point_idx, first = np.unique(point_idx, return_index=True)
+        positions[point_idx] = cell_idx[first]
+        return positions
+
+    def lookup(self, points: dict) -> np.ndarray:
+        """Position (in the cells dict) of the cell that contains each point.
+
+        Parameters
+        ----------
+        points : dict[str:Point]
+            Dict of point names with corresponding shapely coordinate points.
+
+        Returns
+        -------
+        np.ndarray
+            Cell position per point, -1 when a point is not within any cell.
+        """
+        key = tuple((name, point.x, point.y) for name, point in points.items())
+        if key not in self._lookup_cache:
+            if self.regular:
+                x = np.array([point.x for point in points.values()], dtype=float)
+                y = np.array([point.y for point in points.values()], dtype=float)
+                positions = self._lookup_regular(x, y)
+            else:
+                positions = self._lookup_tree(list(points.values()))
+            self._lookup_cache[key] = positions
+        return self._lookup_cache[key]
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
+
+
+# Cell indexes are the same for every chunk, data source and organisation
+# with the same extent, so they are only built once per session.
+_CELL_INDEX_CACHE = {}
+
+
+def get_cell_index(cells: dict, extent: list = None) -> CellIndex:
+    """Return the cached CellIndex for these cells, build it when needed.
+
+    Parameters
+    ----------
+    cells : dict[str:Polygon]
+        The cell names with their corresponding shapely polygons.
+    extent : list, optional
+        extent xmin, ymin, xmax, ymax of the download, used as cache key.
+
+    Returns
+    -------
+    CellIndex
+    """
+    key = (tuple(extent) if extent is not None else None, tuple(cells.keys()))
+    if key not in _CELL_INDEX_CACHE:
+        _CELL_INDEX_CACHE[key] = CellIndex(cells)
+    return _CELL_INDEX_CACHE[key]
+
+
+def gather_points(df: pd.DataFrame, cells: dict, points: dict, extent: list = None, nodata: float = -999.0) -> np.ndarray:
+    """Values of the cells that contain the points as a (time, point) float32 array.
+
+    Only the columns of the cells with a point are read from df, there is no
+    intermediate wide dataframe.
+
+    Parameters
+    ----------
+    df : DataFrame
+        dataframe of radar precipitation values with cells as columns
+    cells : dict[str:Polygon]
+        The cell names with their corresponding shapely polygons.
+    points : dict[str:Point]
+        Dict of point names with corresponding shapely coordinate points.
+    extent : list, optional
+        extent of the download, used to reuse the cell index between calls.
+    nodata : float, optional
+        value that is replaced by nan.
+
+    Returns
+    -------
+    np.ndarray
+        (time, point) values in the order of points. Points outside the grid
+        get nan values.
+    """
+    cell_index = get_cell_index(cells, extent)
+    positions = cell_index.lookup(points)
+
+    cell_names = [cell_index.names[i] if i >= 0 else None for i in positions]
+    columns = df.columns.get_indexer(cell_names)
+
+    values = np.full((len(df), len(columns)), np.nan, dtype=np.float32)
+    for j, column in enumerate(columns):
+        if column >= 0:
+            values[:, j] = df.iloc[:, column].to_numpy()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    return values
+
+
+def add_columns_for_points(df: pd.DataFrame, cells: dict, points: dict, extent: list = None):
     """Replace a dataframe with cells with a dataframe with a column for every point
     and where the value is retried from the corresponding grid cell.
 
@@ -48,27 +228,62 @@ def add_columns_for_points(df: pd.DataFrame, cells: dict, points: dict):
     ----------
     df : DataFrame
         dataframe of radar precipitation values with cells as columns
-    cells : dict[str:Point]
-        The cell names with their corresponding shapely coordinate points.
+    cells : dict[str:Polygon]
+        The cell names with their corresponding shapely polygons.
     points : dict[str:Point]
         Dict of point names with corresponding shapely coordinate points.
+    extent : list, optional
+        extent of the download, used to reuse the cell index between calls.
 
     Returns
     -------
     DataFrame
-        New dataframe with the point keys as columns.
+        New dataframe with the point keys as columns. Points outside the
+        grid get a column with nan values.
+    """
+    values = gather_points(df, cells, points, extent=extent, nodata=None)
+    return pd.DataFrame(values, index=df.index, columns=list(points.keys()))
+
+
+class PointSeries:
+    """Compact timeseries of the points, values is a (time, location) float32 array.
+
+    Parameters
+    ----------
+    time : DatetimeIndex
+        time of the rows in values
+    locations : list
+        point names of the columns in values
+    values : np.ndarray
+        (time, location) float32 array
     """
-    new_df_list = []
-    for name, point in points.items():
-        for i, cell in cells.items():
-            if point.within(cell):
-                break       
-        new_df_list.append(df[i].rename(name))
-    new_df = pd.concat(new_df_list, axis=1)
-    return new_df
 
+    def __init__(self, time, locations, values):
+        self.time = pd.DatetimeIndex(time, name="DateTime")
+        self.locations = pd.Index(locations, name="Locatie", tupleize_cols=False)
+        self.values = values
 
-def download_wiwb(data_source: str, points: dict, start: datetime, end: datetime, extent: list) -> pd.Series:
+    @property
+    def empty(self):
+        return self.values.size == 0
+
+    def to_frame(self) -> pd.DataFrame:
+        """Wide dataframe with DateTime as index and a column per location (no copy)."""
+        return pd.DataFrame(self.values, index=self.time, columns=self.locations, copy=False)
+
+    def to_series(self) -> pd.Series:
+        """Stacked series with sorted (DateTime, Locatie) index, nan values are dropped."""
+        order = np.argsort(self.locations.values)
+        values = self.values[:, order].ravel()
+        index = pd.MultiIndex.from_product([self.time, self.locations[order]])
+        keep = ~np.isnan(values)
+        return pd.Series(values[keep], index=index[keep], name="neerslag")
+
+    def __repr__(self):
+        return f"PointSeries {self.values.shape} {self.time.min()} - {self.time.max()}"
+
+
+def download_wiwb(data_source: str, points: dict, start: datetime, end: datetime, extent: list, downloader_cls=None, cube=None, return_series=True) -> pd.Series:
     """Download grid data from the wiwb and parse to series with multiindex (datetime, location).
 
     Parameters
@@ -81,6 +296,15 @@ def download_wiwb(data_source: str, points: dict, start: datetime, end: datetime
         start time for download
     end : datetime
         end time for download
+    extent : list
+        extent xmin, ymin, xmax, ymax of the download
+    downloader_cls : class, optional
+        downloader to use, defaults to wiwb_downloader.GridDownloader. Use
+        wiwb_local.LocalGridDownloader to test without the wiwb.
+    cube : irc_cube.IrcCube, optional
+        when provided the full grids are also saved in the cube.
+    return_series : bool, optional
+        False returns the compact PointSeries instead of the stacked series.
 
     Returns
     -------
@@ -89,10 +313,12 @@ def download_wiwb(data_source: str, points: dict, start: datetime, end: datetime
 
     Raises
     ------
-    ValueError
+    NoDataError
         Fail when no data is returned from the wiwb.
     """
-    downloader = GridDownloader(data_source=data_source,
+    if downloader_cls is None:
+        downloader_cls = GridDownloader
+    downloader = downloader_cls(data_source=data_source,
                                 extent=extent,
                                 type='grids',
                                 start_date=format_datetime(start),
@@ -106,14 +332,22 @@ def download_wiwb(data_source: str, points: dict, start: datetime, end: datetime
                                         "Value": 1}
                                     })
     df = downloader.download(return_df=True)
-    df.set_index('StartDate', inplace=True)
+    time = pd.DatetimeIndex(df['StartDate'])
     cells = downloader.cells
-    df = add_columns_for_points(df, cells, points)
-    df = df.replace(-999.0, np.nan).dropna(how='all')
-    if df.empty:
-        raise ValueError(f"No data from source: {data_source}")
-    df = df.astype(np.float32)
-    df = df.stack().rename('neerslag')
-    df.index.names = ['DateTime','Locatie']
-    df.sort_index(inplace=True)
-    return df
+    if cube is not None:
+        cell_index = get_cell_index(cells, extent)
+        values = df[cell_index.names].to_numpy(dtype=np.float32, copy=True)
+        values[values == -999.0] = np.nan
+        cube.write_chunk(start, time, values, cell_index)
+
+    values = gather_points(df, cells, points, extent=extent)
+    del df
+
+    # Drop timesteps without any data
+    keep = ~np.isnan(values).all(axis=1)
+    point_series = PointSeries(time[keep], list(points.keys()), values[keep])
+    if point_series.empty:
+        raise NoDataError(f"No data from source: {data_source}")
+    if return_series:
+        return point_series.to_series()
+    return point_series
@@ -0,0 +1,114 @@
+"""Offline stand-in for the wiwb_downloader.GridDownloader.
+
+Generates random IRC grids for the requested extent and period, with a
+configurable latency and failure rate. Use it to test the download scheduler
+without credentials or network, e.g.:
+
+    wiwb.download_wiwb(..., downloader_cls=LocalGridDownloader)
+"""
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+
+INTERVAL_FREQ = {"Minutes": "min", "Hours": "h", "Days": "D"}
+
+
+class LocalGridDownloader:
+    """Same interface as wiwb_downloader.GridDownloader, but the data is generated locally.
+
+    Class attributes can be changed to simulate the wiwb:
+        latency         seconds each download takes
+        failure_rate    fraction of downloads that raise a ConnectionError
+        nodata_rate     fraction of values that are returned as -999
+        cellsize        size of the grid cells in m (IRC grid is 1km)
+
+    The counters `calls`, `failures`, `active` and `max_active` are kept on the
+    class so the concurrency of the scheduler can be checked afterwards.
+    """
+
+    latency = 0.5
+    failure_rate = 0.0
+    nodata_rate = 0.01
+    cellsize = 1000
+
+    calls = 0
+    failures = 0
+    active = 0
+    max_active = 0
+    _lock = threading.Lock()
+
+    def __init__(self, data_source, extent, type="grids", start_date=None, end_date=None, args=None):
+        self.data_source = data_source
+        self.extent = extent
+        self.type = type
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.args = args or {}
+        self._cells = None
+
+    @classmethod
+    def reset(cls):
+        """Reset the counters"""
+        with cls._lock:
+            cls.calls = 0
+            cls.failures = 0
+            cls.active = 0
+            cls.max_active = 0
+
+    @property
+    def freq(self):
+        interval = self.args.get("Interval", {"Type": "Hours", "Value": 1})
+        return f"{interval['Value']}{INTERVAL_FREQ[interval['Type']]}"
+
+    @property
+    def cells(self):
+        """dict with cell name: shapely box, covering the extent with the IRC grid."""
+        if self._cells is None:
+            xmin, ymin, xmax, ymax = self.extent
+            x0 = np.floor(xmin / self.cellsize) * self.cellsize
+            y1 = np.floor(ymax / self.cellsize) * self.cellsize + self.cellsize
+            ncols = int(np.floor(xmax / self.cellsize) * self.cellsize + self.cellsize - x0) // self.cellsize
+            nrows = int(y1 - np.floor(ymin / self.cellsize) * self.cellsize) // self.cellsize
+
+            self._cells = {}
+            for row in range(nrows):
+                for col in range(ncols):
+                    x = x0 + col * self.cellsize
+                    y = y1 - row * self.cellsize
+                    self._cells[f"{row}_{col}"] = box(x, y - self.cellsize, x + self.cellsize, y)
+        return self._cells
+
+    def download(self, return_df=True):
+        """Return a dataframe with a StartDate column and a column per cell."""
+        cls = type(self)
+        with cls._lock:
+            cls.calls += 1
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(self.latency)
+            if random.random() < self.failure_rate:
+                with cls._lock:
+                    cls.failures += 1
+                raise ConnectionError(f"Simulated wiwb failure: {self.data_source} {self.start_date}")
+
+            # Same data for the same source and period, independent of the order of requests.
+            seed = zlib.crc32(f"{self.data_source}{self.start_date}".encode())
+            rng = np.random.default_rng(seed)
+
+            dates = pd.date_range(self.start_date, self.end_date, freq=self.freq, inclusive="left")
+            values = rng.gamma(0.2, 1.0, size=(len(dates), len(self.cells))).astype(np.float32)
+            values[rng.random(values.shape) < self.nodata_rate] = -999.0
+
+            df = pd.DataFrame(values, columns=list(self.cells.keys()))
+            df.insert(0, "StartDate", dates)
+            return df
+        finally:
+            with cls._lock:
+                cls.active -= 1
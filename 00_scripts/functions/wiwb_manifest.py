@@ -0,0 +1,234 @@
+import hashlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Windows are aligned to this date, so the same windows are used when the
+# start or end date of a download changes.
+WINDOW_EPOCH = datetime(2022, 1, 1)
+
+MANIFEST_COLUMNS = [
+    "organisation",
+    "data_source",
+    "extent_hash",
+    "start",
+    "end",
+    "status",
+    "rows",
+    "path",
+    "updated",
+    "last_failed",
+]
+
+# A window is final when it ended before the MAX_END_DATE of the product, it
+# will not be downloaded again. Partial windows are downloaded up to the
+# MAX_END_DATE and are completed on the next run.
+STATUS_FINAL = "final"
+STATUS_PARTIAL = "partial"
+STATUS_FAILED = "failed"
+# A failed retry of a downloaded window keeps the status of the earlier
+# download (the partition is still on disk), the failure is noted in last_failed.
+
+
+def extent_hash(extent: list, points: dict) -> str:
+    """Short hash of the download extent and the point names. When a station is
+    added or moved the hash changes and all windows are downloaded again.
+
+    Parameters
+    ----------
+    extent : list
+        extent xmin, ymin, xmax, ymax of the download
+    points : dict[str:Point]
+        Dict of point names with corresponding shapely coordinate points.
+
+    Returns
+    -------
+    str
+    """
+    text = ";".join([f"{i:.1f}" for i in extent])
+    text += ";" + ";".join(f"{name}:{point.x:.1f}:{point.y:.1f}" for name, point in sorted(points.items()))
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def make_windows(start_date: datetime, end_date: datetime, days: int = 10, epoch: datetime = WINDOW_EPOCH) -> list:
+    """Split the period into download windows aligned to the epoch.
+
+    Parameters
+    ----------
+    start_date : datetime
+        the first window contains this date
+    end_date : datetime
+        the last window starts before this date
+    days : int
+        length of a window in days
+    epoch : datetime
+        windows start at epoch + n * days
+
+    Returns
+    -------
+    list[tuple[datetime, datetime]]
+        (start, end) of every window
+    """
+    step = timedelta(days=days)
+    current = epoch + ((start_date - epoch) // step) * step
+    windows = []
+    while current < end_date:
+        windows.append((current, current + step))
+        current += step
+    return windows
+
+
+class ChunkManifest:
+    """Administration of downloaded wiwb windows, saved as csv next to the raw data.
+
+    Every downloaded window is stored as a partition:
+        {folder}/{organisation}/{data_source}/{organisation}_{data_source}_raw_{start}.parquet
+
+    Parameters
+    ----------
+    folder : str
+        folder with the raw wiwb data (01_data/p_raw_wiwb)
+    days : int
+        length of a window in days
+    """
+
+    def __init__(self, folder, days=10):
+        self.folder = Path(folder)
+        self.path = self.folder / "manifest.csv"
+        self.days = days
+
+        if self.path.exists():
+            self.df = pd.read_csv(self.path, parse_dates=["start", "end", "updated"])
+            self.df = self.df.reindex(columns=MANIFEST_COLUMNS)  # Manifests without last_failed
+            self.df["last_failed"] = pd.to_datetime(self.df["last_failed"])
+        else:
+            self.df = pd.DataFrame(columns=MANIFEST_COLUMNS)
+
+    def partition_path(self, organisation, data_source, start) -> Path:
+        return (
+            self.folder
+            / organisation
+            / data_source
+            / f"{organisation}_{data_source}_raw_{start.strftime('%Y%m%d')}.parquet"
+        )
+
+    def entries(self, organisation, data_source, extent_hash) -> pd.DataFrame:
+        """Manifest rows of the organisation and data source with the current extent."""
+        return self.df[
+            (self.df["organisation"] == organisation)
+            & (self.df["data_source"] == data_source)
+            & (self.df["extent_hash"] == extent_hash)
+        ]
+
+    def pending(self, organisation, data_source, extent_hash, start_date, end_date, max_end_date) -> list:
+        """Windows that still need to be downloaded.
+
+        Windows that are final are skipped, as are windows that start after the
+        max_end_date of the product (no data yet).
+
+        Returns
+        -------
+        list[tuple[datetime, datetime, bool]]
+            (start, end, final) of every window. For partial windows the end is
+            the max_end_date.
+        """
+        entries = self.entries(organisation, data_source, extent_hash)
+        done = set(entries.loc[entries["status"] == STATUS_FINAL, "start"])
+
+        pending = []
+        for start, end in make_windows(start_date, end_date, days=self.days):
+            if start >= max_end_date or start in done:
+                continue
+            final = end < max_end_date
+            pending.append((start, end if final else max_end_date, final))
+        return pending
+
+    def record(self, organisation, data_source, extent_hash, start, status, rows=0):
+        """Add or replace the manifest row of a window. When the download of a window
+        that was already downloaded fails, the earlier status and rows are kept and
+        only last_failed is set, so partitions still returns it."""
+        key = (
+            (self.df["organisation"] == organisation)
+            & (self.df["data_source"] == data_source)
+            & (self.df["extent_hash"] == extent_hash)
+            & (self.df["start"] == start)
+        )
+        last_failed = None
+        if status == STATUS_FAILED:
+            last_failed = datetime.now()
+            downloaded = self.df[key & self.df["status"].isin([STATUS_FINAL, STATUS_PARTIAL])]
+            if not downloaded.empty:
+                status = downloaded["status"].iloc[0]
+                rows = downloaded["rows"].iloc[0]
+        row = pd.DataFrame(
+            [
+                {
+                    "organisation": organisation,
+                    "data_source": data_source,
+                    "extent_hash": extent_hash,
+                    "start": start,
+                    "end": start + timedelta(days=self.days),
+                    "status": status,
+                    "rows": rows,
+                    "path": str(self.partition_path(organisation, data_source, start).relative_to(self.folder)),
+                    "updated": datetime.now(),
+                    "last_failed": last_failed,
+                }
+            ],
+            columns=MANIFEST_COLUMNS,
+        )
+        self.df = pd.concat([self.df[~key], row], ignore_index=True)
+
+    def partitions(self, organisation, data_source, extent_hash) -> list:
+        """Paths of all downloaded windows, sorted by start date. Windows without
+        data (rows=0) have no partition."""
+        entries = self.entries(organisation, data_source, extent_hash)
+        entries = entries[
+            entries["status"].isin([STATUS_FINAL, STATUS_PARTIAL]) & (entries["rows"] > 0)
+        ].sort_values("start")
+        return [self.folder / i for i in entries["path"]]
+
+    def consolidate(self, organisation, data_source, extent_hash, output_path) -> int:
+        """Write all partitions into a single parquet file with the (DateTime, Locatie)
+        layout of the raw downloads.
+
+        The partitions are streamed into the file one window (row group) at a
+        time, so memory use does not grow with the length of the period.
+        Timestamps that are also in the previous window are skipped.
+
+        Returns
+        -------
+        int
+            number of rows written
+        """
+        writer = None
+        last_time = None
+        rows = 0
+        try:
+            for partition in self.partitions(organisation, data_source, extent_hash):
+                df = pd.read_parquet(partition)
+                if last_time is not None:
+                    df = df[df.index.get_level_values("DateTime") > last_time]
+                if df.empty:
+                    continue
+                last_time = df.index.get_level_values("DateTime").max()
+
+                table = pa.Table.from_pandas(df)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+                rows += len(df)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    def save(self):
+        self.df.sort_values(["organisation", "data_source", "start"]).to_csv(self.path, index=False)
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
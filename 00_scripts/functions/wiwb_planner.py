@@ -0,0 +1,148 @@
+import numpy as np
+
+import functions.wiwb as wiwb
+
+
+def snap_extent(extent: list, cellsize: float = 1000) -> list:
+    """Snap the extent outwards to the IRC grid.
+
+    Parameters
+    ----------
+    extent : list
+        extent xmin, ymin, xmax, ymax
+    cellsize : float
+        size of the grid cells in m (IRC grid is 1km)
+
+    Returns
+    -------
+    list
+        extent xmin, ymin, xmax, ymax on the grid.
+    """
+    xmin, ymin, xmax, ymax = extent
+    return [
+        float(np.floor(xmin / cellsize) * cellsize),
+        float(np.floor(ymin / cellsize) * cellsize),
+        float(np.floor(xmax / cellsize) * cellsize + cellsize),
+        float(np.floor(ymax / cellsize) * cellsize + cellsize),
+    ]
+
+
+def count_cells(extent: list, cellsize: float = 1000) -> int:
+    """Number of grid cells within a snapped extent."""
+    xmin, ymin, xmax, ymax = extent
+    return int(round((xmax - xmin) / cellsize) * round((ymax - ymin) / cellsize))
+
+
+def union_extent(extent_a: list, extent_b: list) -> list:
+    return [
+        min(extent_a[0], extent_b[0]),
+        min(extent_a[1], extent_b[1]),
+        max(extent_a[2], extent_b[2]),
+        max(extent_a[3], extent_b[3]),
+    ]
+
+
+class DownloadGroup:
+    """Organisations that are downloaded with one grid request.
+
+    Parameters
+    ----------
+    points_org : dict[str:dict[str:Point]]
+        Points per organisation in this group.
+    extent : list
+        snapped extent xmin, ymin, xmax, ymax of the grid request.
+    """
+
+    def __init__(self, points_org: dict, extent: list):
+        self.points_org = points_org
+        self.extent = extent
+
+    @property
+    def name(self):
+        return "+".join(self.organisations)
+
+    @property
+    def organisations(self):
+        return list(self.points_org.keys())
+
+    @property
+    def points(self):
+        """All points of the group, used for the download. Keyed by (organisation, name),
+        stations with the same name in different organisations are separate points."""
+        return {
+            (organisation, name): point
+            for organisation, points in self.points_org.items()
+            for name, point in points.items()
+        }
+
+    def split(self, point_series):
+        """Split the wiwb.PointSeries of a download of the group (download_wiwb with
+        return_series=False) into a (DateTime, Locatie) series per organisation."""
+        keys = list(self.points)
+        split = {}
+        for organisation in self.points_org:
+            columns = [i for i, key in enumerate(keys) if key[0] == organisation]
+            split[organisation] = wiwb.PointSeries(
+                point_series.time,
+                [keys[i][1] for i in columns],
+                point_series.values[:, columns],
+            ).to_series()
+        return split
+
+    def __repr__(self):
+        return f"{self.name} - extent {self.extent}"
+
+
+def plan_downloads(points_org: dict, cellsize: float = 1000, request_cost: int = 0) -> list:
+    """Merge the extents of the organisations into as few grid requests as possible.
+
+    Two requests are merged when the union of their extents does not contain
+    more cells than both requests separately (+ request_cost). Overlapping
+    cells are then downloaded once instead of once per organisation. This is
+    repeated, merging the pair with the largest saving first, until no pair
+    can be merged.
+
+    Parameters
+    ----------
+    points_org : dict[str:dict[str:Point]]
+        Points per organisation, see wiwb.get_points_from_gdf.
+    cellsize : float
+        size of the grid cells in m (IRC grid is 1km)
+    request_cost : int
+        overhead of a single request expressed in number of cells. Higher values
+        result in fewer but larger requests.
+
+    Returns
+    -------
+    list[DownloadGroup]
+    """
+    groups = []
+    for organisation, points in points_org.items():
+        x = [point.x for point in points.values()]
+        y = [point.y for point in points.values()]
+        extent = snap_extent([min(x), min(y), max(x), max(y)], cellsize=cellsize)
+        groups.append(DownloadGroup({organisation: points}, extent))
+
+    while len(groups) > 1:
+        best = None
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                separate = (
+                    count_cells(groups[i].extent, cellsize)
+                    + count_cells(groups[j].extent, cellsize)
+                    + request_cost
+                )
+                merged = count_cells(union_extent(groups[i].extent, groups[j].extent), cellsize)
+                saving = separate - merged
+                if saving >= 0 and (best is None or saving > best[0]):
+                    best = (saving, i, j)
+        if best is None:
+            break
+
+        _, i, j = best
+        merged_group = DownloadGroup(
+            {**groups[i].points_org, **groups[j].points_org},
+            union_extent(groups[i].extent, groups[j].extent),
+        )
+        groups = [group for k, group in enumerate(groups) if k not in (i, j)] + [merged_group]
+    return groups
@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+
+class DownloadJob:
+    """A single download window of one data source for one download group
+    (one or more organisations, see wiwb_planner.DownloadGroup)."""
+
+    def __init__(self, group, data_source, start, end, final=True, host="wiwb"):
+        self.group = group
+        self.data_source = data_source
+        self.start = start
+        self.end = end
+        self.final = final  # False when the window is only partially available
+        self.host = host
+
+        self.status = "pending"
+        self.attempts = 0
+        self.error = None
+        self.duration = None
+        self.result = None
+
+    @property
+    def key(self):
+        return (self.group, self.data_source, self.start)
+
+    def __repr__(self):
+        return f"{self.group} - {self.data_source} - {self.start} to {self.end} ({self.status})"
+
+
+class DownloadScheduler:
+    """Run download jobs in a bounded thread pool.
+
+    Parameters
+    ----------
+    download_func : callable
+        function that takes a DownloadJob and returns the downloaded data.
+    max_workers : int
+        number of threads.
+    max_per_host : int
+        max number of simultaneous downloads per host (job.host).
+    max_retries : int
+        number of retries after the first attempt has failed.
+    backoff : float
+        delay in seconds before the first retry, doubled for every next retry.
+    max_backoff : float
+        max delay in seconds between retries.
+    no_retry : tuple[Exception]
+        exceptions that are not retried, the job fails immediately.
+    no_data : tuple[Exception]
+        exceptions that mean the source has no data for the window, e.g.
+        wiwb.NoDataError. The job is not retried and gets status "empty"
+        (completed without data) instead of "failed".
+    """
+
+    def __init__(
+        self,
+        download_func,
+        max_workers=8,
+        max_per_host=4,
+        max_retries=3,
+        backoff=2.0,
+        max_backoff=60.0,
+        no_retry=(),
+        no_data=(),
+        verbose=True,
+    ):
+        self.download_func = download_func
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.no_retry = no_retry
+        self.no_data = no_data
+        self.verbose = verbose
+
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def host_semaphore(self, host):
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_semaphores[host]
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with jitter, so failed jobs dont retry at the same moment."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def run_job(self, job):
+        """Download a single job, retry with backoff until max_retries is reached."""
+        start_time = time.perf_counter()
+        while True:
+            job.attempts += 1
+            try:
+                with self.host_semaphore(job.host):
+                    job.result = self.download_func(job)
+                job.status = "done"
+                job.error = None
+                break
+            except self.no_data:
+                job.status = "empty"
+                job.error = None
+                break
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                if isinstance(e, self.no_retry) or job.attempts > self.max_retries:
+                    job.status = "failed"
+                    break
+                # Sleep outside the host semaphore so other jobs can continue.
+                time.sleep(self.backoff_delay(job.attempts))
+        job.duration = time.perf_counter() - start_time
+        return job
+
+    def run(self, jobs):
+        """Run all jobs, returns the jobs with status, result and error filled in."""
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.run_job, job) for job in jobs]
+            for i, future in enumerate(as_completed(futures), start=1):
+                job = future.result()
+                if self.verbose:
+                    print(f"    [{i}/{len(jobs)}] {job}", end="\n" if job.status == "failed" else "\r")
+        if self.verbose:
+            print(f"\nFinished {len(jobs)} jobs, {len(self.failed(jobs))} failed")
+        return jobs
+
+    @staticmethod
+    def failed(jobs):
+        return [job for job in jobs if job.status == "failed"]
+
+    @staticmethod
+    def failure_report(jobs) -> pd.DataFrame:
+        """Table with a row for every window that could not be downloaded."""
+        return pd.DataFrame(
+            [
+                {
+                    "group": job.group,
+                    "data_source": job.data_source,
+                    "start": job.start,
+                    "end": job.end,
+                    "attempts": job.attempts,
+                    "error": job.error,
+                }
+                for job in jobs
+                if job.status == "failed"
+            ],
+            columns=["group", "data_source", "start", "end", "attempts", "error"],
+        )
+
+    def __repr__(self):
+        return "." + " .".join([i for i in dir(self) if not i.startswith("__")])
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts run from 00_scripts and import the modules as functions.<module>.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
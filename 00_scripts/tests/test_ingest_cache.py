@@ -0,0 +1,102 @@
+import os
+
+import pandas as pd
+import pytest
+
+import functions.ingest_cache as ingest_cache
+
+ORG = "HHNK"
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    (raw / "a.csv").write_text("1;2\n")
+    (raw / "b.csv").write_text("3;4\n")
+    metadata = tmp_path / "metadata.xlsx"
+    metadata.write_text("meta")
+    settings = {"raw_filepath": raw, "metadata_file": metadata, "resample_rule": "h"}
+    return settings
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ingest_cache.IngestCache(tmp_path / "cache")
+
+
+def frames():
+    index = pd.date_range("2022-01-01", periods=3, freq="h", name="datetime")
+    df_value = pd.DataFrame({"s1": [1.0, 2.0, 3.0]}, index=index)
+    return df_value.isna(), df_value
+
+
+def fingerprint(cache, settings):
+    return cache.fingerprint(ORG, ingest_cache.input_files(settings), settings)
+
+
+def save(cache, settings):
+    df_mask, df_value = frames()
+    cache.save(ORG, fingerprint(cache, settings), df_mask, df_value, {"s1": "location"})
+
+
+def rewrite(path, text):
+    """Same size, so the change is only noticed when the mtime differs."""
+    stat = path.stat()
+    path.write_text(text)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+
+def test_input_files(inputs):
+    assert ingest_cache.input_files(inputs) == [inputs["raw_filepath"], inputs["metadata_file"]]
+    assert ingest_cache.input_files({"raw_filepath": "x", "metadata_file": None}) == ["x"]
+
+
+def test_round_trip(cache, inputs):
+    assert cache.load(ORG, fingerprint(cache, inputs)) is None
+    save(cache, inputs)
+
+    df_mask, df_value, locations = cache.load(ORG, fingerprint(cache, inputs))
+    pd.testing.assert_frame_equal(df_value, frames()[1], check_freq=False)
+    pd.testing.assert_frame_equal(df_mask, frames()[0], check_freq=False)
+    assert locations == {"s1": "location"}
+
+
+def test_touched_file_is_still_valid(cache, inputs):
+    save(cache, inputs)
+    path = inputs["raw_filepath"] / "a.csv"
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+    assert cache.load(ORG, fingerprint(cache, inputs)) is not None
+    # The new stat is saved, the content hash is not computed again.
+    assert cache.read_fingerprint(ORG)["files"] == ingest_cache.stat_fingerprint(ingest_cache.input_files(inputs))
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda settings: rewrite(settings["raw_filepath"] / "a.csv", "1;5\n"),
+        lambda settings: (settings["raw_filepath"] / "c.csv").write_text("5;6\n"),
+        lambda settings: (settings["raw_filepath"] / "b.csv").unlink(),
+        lambda settings: settings["metadata_file"].write_text("other meta"),
+        lambda settings: settings.update(resample_rule="d"),
+    ],
+    ids=["raw content", "raw file added", "raw file removed", "metadata", "settings"],
+)
+def test_change_invalidates(cache, inputs, change):
+    save(cache, inputs)
+    change(inputs)
+    assert cache.load(ORG, fingerprint(cache, inputs)) is None
+
+
+def test_execution_settings_keep_cache(cache, inputs):
+    save(cache, inputs)
+    inputs["processes"] = 4
+    assert cache.load(ORG, fingerprint(cache, inputs)) is not None
+
+
+def test_interrupted_save_is_not_used(cache, inputs):
+    save(cache, inputs)
+    (cache.path(ORG) / "fingerprint.json").unlink()
+    assert cache.load(ORG, fingerprint(cache, inputs)) is None
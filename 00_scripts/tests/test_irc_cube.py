@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+import functions.irc_cube as irc_cube
+import functions.wiwb as wiwb
+from functions.wiwb_local import LocalGridDownloader
+
+EXTENT_OLD = [100000, 500000, 103500, 502500]
+# Larger extent after a station was added, the grid origin moves as well.
+EXTENT_NEW = [98500, 500000, 105500, 503500]
+
+
+@pytest.fixture
+def cube(tmp_path):
+    return irc_cube.IrcCube(tmp_path, "irc_final")
+
+
+def write(cube, extent, start, periods, value, mtime=None):
+    """Chunk with a constant value, the cell index is the one of the downloader."""
+    cells = LocalGridDownloader("irc_final", extent).cells
+    cell_index = wiwb.CellIndex(cells)
+    time = pd.date_range(start, periods=periods, freq="h")
+    cube.write_chunk(start, time, np.full((periods, len(cells)), value, dtype=np.float32), cell_index)
+    if mtime is not None:
+        tile_path = cube.path / cube.tile_name(
+            {
+                "xmin": cell_index.xmin,
+                "ymax": cell_index.ymax,
+                "dx": cell_index.dx,
+                "dy": cell_index.dy,
+                "nrows": cell_index.nrows,
+                "ncols": cell_index.ncols,
+            }
+        )
+        os.utime(tile_path / f"{pd.Timestamp(start).strftime('%Y%m%d')}_time.npy", (mtime, mtime))
+
+
+def test_sample_single_tile(cube):
+    write(cube, EXTENT_OLD, "2022-01-01", 24, 1.0)
+    df = cube.sample({"a": Point(101500, 501500), "outside": Point(0, 0)})
+
+    assert list(df.columns) == ["a"]
+    assert len(df) == 24
+    assert (df["a"] == 1.0).all()
+
+
+def test_sample_combines_overlapping_tiles(cube):
+    points = {"a": Point(101500, 501500), "new": Point(105200, 503200)}
+    write(cube, EXTENT_OLD, "2022-01-01", 24, 1.0, mtime=1000)
+    write(cube, EXTENT_NEW, "2022-01-01 12:00", 24, 2.0, mtime=2000)
+    assert len(cube.tiles) == 2
+
+    df = cube.sample(points)
+    index = pd.date_range("2022-01-01", periods=36, freq="h")
+    assert df.index.equals(pd.DatetimeIndex(index, name="DateTime").as_unit(df.index.unit))
+    # The point in both tiles gets the rows of both, the newest chunk wins the overlap.
+    assert (df["a"].iloc[:12] == 1.0).all()
+    assert (df["a"].iloc[12:] == 2.0).all()
+    # The point that is only in the new tile.
+    assert df["new"].iloc[:12].isna().all()
+    assert (df["new"].iloc[12:] == 2.0).all()
+
+
+def test_sample_newest_chunk_wins(cube):
+    point = {"a": Point(101500, 501500)}
+    write(cube, EXTENT_NEW, "2022-01-01", 24, 2.0, mtime=1000)
+    write(cube, EXTENT_OLD, "2022-01-01", 24, 1.0, mtime=2000)
+
+    assert (cube.sample(point)["a"] == 1.0).all()
+
+
+def test_sample_period(cube):
+    write(cube, EXTENT_OLD, "2022-01-01", 24, 1.0, mtime=1000)
+    write(cube, EXTENT_NEW, "2022-01-02", 24, 2.0, mtime=2000)
+
+    df = cube.sample({"a": Point(101500, 501500)}, start="2022-01-01 20:00", end="2022-01-02 03:00")
+    assert df["a"].tolist() == [1.0] * 4 + [2.0] * 4
+
+
+def test_cell_edge_same_cell_as_point_lookup(cube):
+    cells = LocalGridDownloader("irc_final", EXTENT_OLD).cells
+    cell_index = wiwb.CellIndex(cells)
+    time = pd.date_range("2022-01-01", periods=2, freq="h")
+    values = np.tile(np.arange(len(cells), dtype=np.float32), (2, 1))
+    cube.write_chunk("2022-01-01", time, values, cell_index)
+
+    points = {"edge": Point(101000, 501500), "corner": Point(102000, 502000), "inside": Point(101500, 501500)}
+    positions = cell_index.lookup(points)
+    assert (positions >= 0).all()
+    df = cube.sample(points)
+    assert df.iloc[0].tolist() == positions.tolist()
+
+    # The STRtree fallback gives a cell to the edge points as well.
+    cell_index.regular = False
+    cell_index._lookup_cache = {}
+    assert (cell_index.lookup(points) >= 0).all()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+pytest.importorskip("hhnk_research_tools")  # station_cls depends on it
+import functions.station_cls as station_cls  # noqa: E402
+import functions.station_statistics as station_statistics  # noqa: E402
+import functions.timeseries as timeseries  # noqa: E402
+
+IRC_TYPES = ["irc_realtime", "irc_final"]
+STATIONS = ["wet", "gaps", "dry", "masked"]
+
+# Statistics of IrcStats that network_stats returns, with the number of decimals
+# they are rounded to (None is not rounded).
+STATISTICS = {
+    "gauge_mean": None,
+    "irc_mean": None,
+    "BiasTotal": None,
+    "RelBiasTotal": 1,
+    "gauge_cumu": None,
+    "irc_cumu": None,
+    "BiasTotalCumu": None,
+    "RelBiasTotalCumu": 1,
+    "corr": 2,
+    "stdev": 2,
+    "CV": 2,
+}
+
+
+@pytest.fixture(scope="module")
+def cube():
+    rng = np.random.default_rng(1)
+    index = pd.date_range("2022-01-01", periods=500, freq="h")
+    cube = timeseries.TimeseriesCube(index, STATIONS, ["station"] + IRC_TYPES)
+    shape = (len(index), len(STATIONS))
+
+    gauge = rng.gamma(0.3, 2.0, shape)
+    gauge[rng.random(shape) < 0.3] = 0
+    gauge[rng.random(shape) < 0.05] = np.nan
+    gauge[rng.random(shape) < 0.02] = -999  # Invalid values are skipped
+    gauge[:, 2] = 0  # No rain, gauge_mean is 0
+    cube.set_layer("station", pd.DataFrame(gauge, index=index, columns=STATIONS))
+    for irc_type in IRC_TYPES:
+        irc = gauge.clip(0) * rng.uniform(0.5, 1.5, shape) + rng.gamma(0.1, 0.5, shape)
+        irc[:, 1][rng.random(len(index)) < 0.2] = np.nan
+        cube.set_layer(irc_type, pd.DataFrame(irc, index=index, columns=STATIONS))
+
+    mask = rng.random(shape) < 0.1
+    mask[:, 3] = True  # No usable timesteps
+    cube.set_mask(pd.DataFrame(mask, index=index, columns=STATIONS))
+    cube.attrs["irc_types"] = IRC_TYPES
+    return cube
+
+
+def station(cube, code):
+    row = pd.Series({"WEERGAVENAAM": code, "ID": code, "organisation": "HHNK", "geometry": Point(0, 0)})
+    return station_cls.Station(None, row, "h", irc_types=IRC_TYPES, cube=cube)
+
+
+@pytest.fixture(scope="module")
+def stats(cube):
+    return station_statistics.network_stats(cube).set_index(["ID", "irc_type"])
+
+
+@pytest.mark.parametrize("code", STATIONS[:3])
+def test_network_stats_equal_station_stats(cube, stats, code):
+    station_stats = station_statistics.StationStats(station(cube, code))
+
+    for irc_type in IRC_TYPES:
+        irc_stats = station_stats.irc_stats[irc_type]
+        row = stats.loc[(code, irc_type)]
+        assert row["n"] == len(station_stats.df)
+        for name, decimals in STATISTICS.items():
+            expected = getattr(irc_stats, name)
+            if decimals is None:
+                # StationStats computes in the float32 of the cube, network_stats in float64.
+                np.testing.assert_allclose(row[name], expected, rtol=1e-5, atol=1e-6, err_msg=name)
+            else:
+                # The cube is float32, a value can round to the next decimal.
+                np.testing.assert_allclose(row[name], expected, atol=10**-decimals * 1.01, err_msg=name)
+
+
+def test_network_stats_without_usable_timesteps(cube, stats):
+    for irc_type in IRC_TYPES:
+        row = stats.loc[("masked", irc_type)]
+        assert row["n"] == 0
+        assert row[list(STATISTICS)].isna().all()
+
+    with pytest.raises(IndexError):
+        station_statistics.StationStats(station(cube, "masked"))
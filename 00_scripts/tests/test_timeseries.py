@@ -0,0 +1,177 @@
+import json
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions.timeseries as timeseries
+
+
+def frame(times, **columns):
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(times, name="datetime"))
+
+
+def merge(dict_df):
+    """Reference: outer merge on the index, one frame at a time."""
+    frames = [df.to_frame() if isinstance(df, pd.Series) else df for df in dict_df.values()]
+    return reduce(lambda left, right: pd.merge(left, right, how="outer", left_index=True, right_index=True), frames)
+
+
+# %% align_frames
+def test_align_frames_equals_merge():
+    dict_df = {
+        "a": frame(["2022-01-01 02:00", "2022-01-01 00:00"], a=[1.0, 2.0]),
+        "b": frame(["2022-01-01 01:00", "2022-01-01 02:00"], b=[3.0, 4.0], c=[5.0, 6.0]),
+        "d": pd.Series([7.0], index=pd.DatetimeIndex(["2022-01-01 03:00"], name="datetime"), name="d"),
+    }
+    result = timeseries.align_frames(dict_df)
+    pd.testing.assert_frame_equal(result, merge(dict_df))
+    assert result.index.is_monotonic_increasing
+
+
+def test_align_frames_duplicate_columns_get_suffixes():
+    dict_df = {
+        "a": frame(["2022-01-01 00:00"], v=[1.0], w=[0.0]),
+        "b": frame(["2022-01-01 01:00"], v=[2.0]),
+        "c": frame(["2022-01-01 02:00"], v_x=[3.0]),
+    }
+    result = timeseries.align_frames(dict_df)
+    assert list(result.columns) == ["v_x_x", "w", "v_y", "v_x_y"]
+    pd.testing.assert_frame_equal(result, merge(dict_df))
+
+
+def test_align_frames_duplicate_after_suffixes_raises():
+    dict_df = {
+        "a": frame(["2022-01-01"], v=[1.0], v_x=[1.0]),
+        "b": frame(["2022-01-01"], v=[2.0]),
+    }
+    with pytest.raises(ValueError, match="Duplicate columns"):
+        timeseries.align_frames(dict_df)
+
+
+def test_align_frames_dtypes():
+    dict_df = {
+        "a": frame(["2022-01-01 00:00", "2022-01-01 01:00"], i=[1, 2], b=[True, False], f=np.float32([1, 2])),
+        "b": frame(["2022-01-01 02:00"], s=["x"]),
+    }
+    result = timeseries.align_frames(dict_df)
+    # Missing rows are nan: int becomes float64, bool the nullable boolean, float32 stays float32.
+    assert result["i"].dtype == np.float64
+    assert result["b"].dtype == pd.BooleanDtype()
+    assert result["f"].dtype == np.float32
+    assert result["b"].isna().tolist() == [False, False, True]
+
+    filled = timeseries.align_frames(dict_df, fill_value=0)
+    assert filled["i"].dtype == np.int64
+    assert filled["i"].tolist() == [1, 2, 0]
+
+
+def test_align_frames_empty():
+    assert timeseries.align_frames({}).empty
+
+    dict_df = {"a": frame(["2022-01-01"]), "b": frame(["2022-01-02"], v=[1.0])}
+    result = timeseries.align_frames(dict_df)
+    assert list(result.columns) == ["v"]
+    assert len(result) == 1
+
+
+# %% interval_mask
+INDEX = pd.date_range("2022-01-01", periods=6, freq="h")
+
+
+def test_interval_mask_bounds():
+    mask = timeseries.interval_mask(
+        INDEX,
+        ["a", "b", "c"],
+        [
+            ("a", pd.Timestamp("2022-01-01 01:00"), pd.Timestamp("2022-01-01 03:00")),
+            ("b", None, pd.Timestamp("2022-01-01 01:30")),
+            ("c", pd.Timestamp("2022-01-01 04:00"), None),
+        ],
+    )
+    # start is inclusive, end is exclusive.
+    assert mask[:, 0].tolist() == [False, True, True, False, False, False]
+    assert mask[:, 1].tolist() == [True, True, False, False, False, False]
+    assert mask[:, 2].tolist() == [False, False, False, False, True, True]
+
+
+def test_interval_mask_overlap_and_outside_index():
+    mask = timeseries.interval_mask(
+        INDEX,
+        ["a"],
+        [
+            ("a", pd.Timestamp("2021-12-31"), pd.Timestamp("2022-01-01 02:00")),
+            ("a", pd.Timestamp("2022-01-01 01:00"), pd.Timestamp("2022-01-01 03:00")),
+            ("a", pd.Timestamp("2022-02-01"), None),
+        ],
+    )
+    assert mask[:, 0].tolist() == [True, True, True, False, False, False]
+
+
+def test_interval_mask_ignores_empty_and_unknown():
+    mask = timeseries.interval_mask(
+        INDEX,
+        ["a"],
+        [
+            ("a", pd.Timestamp("2022-01-01 03:00"), pd.Timestamp("2022-01-01 01:00")),
+            ("unknown", None, None),
+        ],
+    )
+    assert mask.shape == (6, 1)
+    assert not mask.any()
+
+
+def test_interval_mask_unsorted_raises():
+    with pytest.raises(ValueError):
+        timeseries.interval_mask(INDEX[::-1], ["a"], [])
+
+
+# %% TimeseriesCube
+def make_cube():
+    index = pd.date_range("2022-01-01", periods=4, freq="h")
+    cube = timeseries.TimeseriesCube(index, ["s1", "s2"], ["station", "irc_final"])
+    cube.set_layer("station", frame(index[1:], s1=[1.0, 2.0, 3.0], s2=[4.0, np.nan, 6.0]))
+    cube.set_layer("irc_final", frame(index, loc1=[1.0, 1.0, 1.0, 1.0]), columns=["loc1", "unknown"])
+    cube.set_mask(frame(index[1:], s1=[False, True, False]))
+    cube.attrs["missing"] = ["s3"]
+    return cube
+
+
+def test_cube_layers_and_mask():
+    cube = make_cube()
+    assert cube.values.dtype == np.float32
+
+    df = cube.frame("s1")
+    assert df["station"].tolist()[1:] == [1.0, 2.0, 3.0]
+    assert np.isnan(df["station"].iloc[0])
+    assert df["irc_final"].tolist() == [1.0] * 4
+    # Timesteps and stations that are not in the mask frame stay masked.
+    assert df["mask"].tolist() == [True, False, True, False]
+    assert cube.frame("s2")["mask"].all()
+    assert cube.frame("s2")["irc_final"].isna().all()
+
+
+def test_cube_save_and_open(tmp_path):
+    cube = make_cube()
+    cube.save(tmp_path / "cube")
+
+    opened = timeseries.TimeseriesCube.open(tmp_path / "cube")
+    assert isinstance(opened.values, np.memmap)
+    assert opened.mask.dtype == bool
+    assert opened.attrs == {"missing": ["s3"]}
+    pd.testing.assert_index_equal(opened.index, cube.index, check_exact=True, exact=False)
+    for station in cube.stations:
+        pd.testing.assert_frame_equal(opened.frame(station), cube.frame(station), check_freq=False, check_index_type=False)
+    assert not list(tmp_path.glob("*.tmp*"))
+
+
+def test_cube_open_older_format(tmp_path):
+    make_cube().save(tmp_path / "cube")
+    meta_path = tmp_path / "cube" / "meta.json"
+    meta = json.loads(meta_path.read_text())
+    meta["format_version"] = timeseries.TimeseriesCube.format_version - 1
+    meta_path.write_text(json.dumps(meta))
+
+    with pytest.raises(ValueError, match="older format"):
+        timeseries.TimeseriesCube.open(tmp_path / "cube")
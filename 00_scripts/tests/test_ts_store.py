@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions.timeseries as timeseries
+import functions.ts_store as ts_store
+
+SOURCE = "HHNK"
+
+
+def make_frames(start="2022-01-30", periods=96, freq="h", stations=("s1", "s2", "s3"), seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=periods, freq=freq, name="datetime")
+    df_value = pd.DataFrame(rng.random((periods, len(stations))), index=index, columns=list(stations))
+    df_mask = pd.DataFrame(rng.random((periods, len(stations))) < 0.2, index=index, columns=list(stations))
+    return df_value, df_mask
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ts_store.TimeseriesStore(tmp_path / "store", row_group_size=16)
+
+
+def assert_frames(result, df_value, df_mask):
+    value, mask = result
+    # The store keeps datetime in ns.
+    df_value = df_value.set_axis(df_value.index.as_unit("ns"))
+    df_mask = df_mask.set_axis(df_mask.index.as_unit("ns"))
+    pd.testing.assert_frame_equal(value, df_value.astype(np.float32), check_freq=False, check_names=False, check_column_type=False)
+    pd.testing.assert_frame_equal(mask, df_mask, check_freq=False, check_names=False, check_column_type=False)
+
+
+def test_table_round_trip():
+    df_value, df_mask = make_frames(periods=5)
+    assert_frames(ts_store.to_frames(ts_store.to_table(df_value, df_mask)), df_value, df_mask)
+
+
+def test_table_without_mask():
+    df_value, _ = make_frames(periods=5)
+    _, mask = ts_store.to_frames(ts_store.to_table(df_value))
+    assert not mask.to_numpy().any()
+
+
+def test_write_and_query(store):
+    df_value, df_mask = make_frames()
+    store.write(SOURCE, {"h": (df_value, df_mask)})
+
+    assert store.sources == [SOURCE]
+    assert store.months(SOURCE, "h") == ["2022-01", "2022-02"]
+    assert_frames(store.query(SOURCE, "h"), df_value, df_mask)
+
+
+def test_query_stations_and_period(store):
+    df_value, df_mask = make_frames()
+    store.write(SOURCE, {"h": (df_value, df_mask)})
+
+    start, end = pd.Timestamp("2022-01-31 20:00"), pd.Timestamp("2022-02-01 03:00")
+    result = store.query(SOURCE, "h", stations=["s3", "s1", "unknown"], start=start, end=end)
+    # Bounds are inclusive, columns keep the order of the store.
+    rows = (df_value.index >= start) & (df_value.index <= end)
+    assert_frames(result, df_value.loc[rows, ["s1", "s3"]], df_mask.loc[rows, ["s1", "s3"]])
+
+
+def test_query_empty(store):
+    value, mask = store.query(SOURCE, "h")
+    assert value.empty and mask.empty
+
+    df_value, df_mask = make_frames()
+    store.write(SOURCE, {"h": (df_value, df_mask)})
+    value, mask = store.query(SOURCE, "h", start="2023-01-01")
+    assert value.empty and mask.empty
+
+
+def test_station_missing_in_a_month_is_masked(store):
+    df_value, df_mask = make_frames(start="2022-01-31", periods=48)
+    january = df_value.index < "2022-02-01"
+    store.write(SOURCE, {"h": (df_value[january], df_mask[january])})
+    store.write(SOURCE, {"h": (df_value.loc[~january, ["s1"]], df_mask.loc[~january, ["s1"]])})
+
+    value, mask = store.query(SOURCE, "h")
+    assert value.loc[~january, "s2"].isna().all()
+    assert mask.loc[~january, "s2"].all()
+
+
+def test_write_replace(store):
+    df_value, df_mask = make_frames()
+    store.write(SOURCE, {"h": (df_value, df_mask)})
+
+    february = df_value.index >= "2022-02-01"
+    store.write(SOURCE, {"h": (df_value[february], df_mask[february])}, replace=True)
+    assert store.months(SOURCE, "h") == ["2022-02"]
+    assert_frames(store.query(SOURCE, "h"), df_value[february], df_mask[february])
+
+
+def test_read_wide(tmp_path):
+    df_value, _ = make_frames()
+    path = tmp_path / "value.parquet"
+    df_value.to_parquet(path)
+
+    result = ts_store.read_wide(path, columns=["s2", "unknown"], start="2022-02-01", end="2022-02-01 05:00")
+    pd.testing.assert_frame_equal(result, df_value.loc["2022-02-01 00:00":"2022-02-01 05:00", ["s2"]], check_freq=False)
+
+
+def test_resume_from(store):
+    assert store.resume_from(SOURCE, ["h", "d"]) is None
+
+    df_value, df_mask = make_frames(start="2022-01-30", periods=24 * 60 // 10 * 2 - 40, freq="10min")
+    resampled = timeseries.cascade_resample(df_value, df_mask, resample_rules=["h", "d"])
+    store.write(SOURCE, {"h": resampled["h"]})
+    # A resolution that is not in the store yet needs a full run.
+    assert store.resume_from(SOURCE, ["h", "d"]) is None
+
+    store.write(SOURCE, resampled)
+    # The last hour and day can be partial bins, start again at the last day.
+    assert store.last_timestamp(SOURCE, "h") == pd.Timestamp("2022-01-31 17:00")
+    assert store.resume_from(SOURCE, ["h", "d"]) == pd.Timestamp("2022-01-31")
+
+
+@pytest.mark.parametrize("cut", ["2022-01-31 13:20", "2022-02-01 00:00", "2022-02-02 23:50"])
+def test_incremental_update_equals_full_write(tmp_path, cut):
+    rules = ["h", "3h", "d"]
+    df_value, df_mask = make_frames(start="2022-01-30", periods=6 * 24 * 5, freq="10min")
+
+    full = ts_store.TimeseriesStore(tmp_path / "full")
+    full.write(SOURCE, timeseries.cascade_resample(df_value, df_mask, resample_rules=rules))
+
+    store = ts_store.TimeseriesStore(tmp_path / "incremental")
+    old = df_value.index < cut
+    store.write(SOURCE, timeseries.cascade_resample(df_value[old], df_mask[old], resample_rules=rules))
+
+    since = store.resume_from(SOURCE, rules)
+    new = df_value.index >= since
+    store.update(SOURCE, timeseries.cascade_resample(df_value[new], df_mask[new], resample_rules=rules))
+
+    for resample_rule in rules:
+        assert store.months(SOURCE, resample_rule) == full.months(SOURCE, resample_rule)
+        value, mask = store.query(SOURCE, resample_rule)
+        assert_frames(full.query(SOURCE, resample_rule), value, mask)
+
+
+def test_update_new_station_is_masked_before(store):
+    df_value, df_mask = make_frames(start="2022-01-31", periods=48)
+    old = df_value.index < "2022-01-31 12:00"
+    store.write(SOURCE, {"h": (df_value.loc[old, ["s1", "s2"]], df_mask.loc[old, ["s1", "s2"]])})
+    store.update(SOURCE, {"h": (df_value[~old], df_mask[~old])})
+
+    value, mask = store.query(SOURCE, "h")
+    assert value.loc[old, "s3"].isna().all()
+    assert mask.loc[old, "s3"].all()
+    assert_frames((value.loc[~old], mask.loc[~old]), df_value[~old], df_mask[~old])
@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import functions.wiwb_manifest as wiwb_manifest
+from functions.wiwb_manifest import STATUS_FAILED, STATUS_FINAL, STATUS_PARTIAL
+
+ORG = "HHNK"
+SOURCE = "irc_final"
+EXTENT = "abc"
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return wiwb_manifest.ChunkManifest(tmp_path, days=10)
+
+
+def status(manifest, start):
+    entries = manifest.entries(ORG, SOURCE, EXTENT)
+    return entries.loc[entries["start"] == start].iloc[0]
+
+
+def write_partition(manifest, start, times):
+    path = manifest.partition_path(ORG, SOURCE, start)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    index = pd.MultiIndex.from_product([pd.DatetimeIndex(times), ["a", "b"]], names=["DateTime", "Locatie"])
+    pd.DataFrame({"P": range(len(index))}, index=index, dtype=float).to_parquet(path)
+
+
+def test_make_windows_aligned_to_epoch():
+    windows = wiwb_manifest.make_windows(datetime(2022, 1, 15), datetime(2022, 2, 1), days=10)
+    assert windows == [
+        (datetime(2022, 1, 11), datetime(2022, 1, 21)),
+        (datetime(2022, 1, 21), datetime(2022, 1, 31)),
+        (datetime(2022, 1, 31), datetime(2022, 2, 10)),
+    ]
+
+
+def test_pending_skips_final_and_future_windows(manifest):
+    manifest.record(ORG, SOURCE, EXTENT, datetime(2022, 1, 1), STATUS_FINAL, rows=10)
+    manifest.record(ORG, SOURCE, EXTENT, datetime(2022, 1, 11), STATUS_PARTIAL, rows=5)
+
+    pending = manifest.pending(
+        ORG, SOURCE, EXTENT, datetime(2022, 1, 1), datetime(2022, 2, 10), max_end_date=datetime(2022, 1, 25)
+    )
+    # The final window is skipped, the partial one is downloaded up to the max_end_date,
+    # the window starting after the max_end_date is not downloaded yet.
+    assert pending == [
+        (datetime(2022, 1, 11), datetime(2022, 1, 21), True),
+        (datetime(2022, 1, 21), datetime(2022, 1, 25), False),
+    ]
+
+
+def test_partial_becomes_final(manifest):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_PARTIAL, rows=5)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FINAL, rows=10)
+
+    assert len(manifest.entries(ORG, SOURCE, EXTENT)) == 1
+    assert status(manifest, start)["status"] == STATUS_FINAL
+    assert status(manifest, start)["rows"] == 10
+
+
+@pytest.mark.parametrize("previous", [STATUS_FINAL, STATUS_PARTIAL])
+def test_failed_retry_keeps_downloaded_window(manifest, previous):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, previous, rows=10)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FAILED)
+
+    row = status(manifest, start)
+    assert row["status"] == previous
+    assert row["rows"] == 10
+    assert pd.notna(row["last_failed"])
+    assert manifest.partitions(ORG, SOURCE, EXTENT) == [manifest.partition_path(ORG, SOURCE, start)]
+
+
+def test_failed_window_is_pending_again(manifest):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FAILED)
+
+    assert status(manifest, start)["status"] == STATUS_FAILED
+    assert manifest.partitions(ORG, SOURCE, EXTENT) == []
+    pending = manifest.pending(ORG, SOURCE, EXTENT, start, datetime(2022, 1, 11), max_end_date=datetime(2023, 1, 1))
+    assert pending == [(start, datetime(2022, 1, 11), True)]
+
+
+def test_empty_window_has_no_partition(manifest):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FINAL, rows=0)
+
+    assert manifest.partitions(ORG, SOURCE, EXTENT) == []
+    assert manifest.pending(ORG, SOURCE, EXTENT, start, datetime(2022, 1, 11), max_end_date=datetime(2023, 1, 1)) == []
+
+
+def test_extent_change_downloads_again(manifest):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FINAL, rows=10)
+
+    pending = manifest.pending(ORG, SOURCE, "other", start, datetime(2022, 1, 11), max_end_date=datetime(2023, 1, 1))
+    assert pending == [(start, datetime(2022, 1, 11), True)]
+
+
+def test_save_and_reload(tmp_path, manifest):
+    start = datetime(2022, 1, 1)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FINAL, rows=10)
+    manifest.record(ORG, SOURCE, EXTENT, start, STATUS_FAILED)
+    manifest.save()
+
+    reloaded = wiwb_manifest.ChunkManifest(tmp_path, days=10)
+    row = status(reloaded, start)
+    assert row["status"] == STATUS_FINAL
+    assert isinstance(row["last_failed"], pd.Timestamp)
+
+
+def test_reload_manifest_without_last_failed(tmp_path, manifest):
+    manifest.record(ORG, SOURCE, EXTENT, datetime(2022, 1, 1), STATUS_FINAL, rows=10)
+    manifest.df.drop(columns="last_failed").to_csv(manifest.path, index=False)
+
+    reloaded = wiwb_manifest.ChunkManifest(tmp_path, days=10)
+    assert list(reloaded.df.columns) == wiwb_manifest.MANIFEST_COLUMNS
+    assert reloaded.df["last_failed"].isna().all()
+
+
+def test_consolidate_skips_overlapping_timesteps(tmp_path, manifest):
+    first, second = datetime(2022, 1, 1), datetime(2022, 1, 11)
+    write_partition(manifest, first, ["2022-01-10 22:00", "2022-01-10 23:00", "2022-01-11 00:00"])
+    write_partition(manifest, second, ["2022-01-11 00:00", "2022-01-11 01:00"])
+    manifest.record(ORG, SOURCE, EXTENT, first, STATUS_FINAL, rows=6)
+    manifest.record(ORG, SOURCE, EXTENT, second, STATUS_PARTIAL, rows=4)
+
+    output_path = tmp_path / "raw.parquet"
+    rows = manifest.consolidate(ORG, SOURCE, EXTENT, output_path)
+
+    df = pd.read_parquet(output_path)
+    assert rows == len(df) == 8
+    assert not df.index.duplicated().any()
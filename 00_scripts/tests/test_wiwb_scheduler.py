@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+from shapely.geometry import Point
+
+import functions.wiwb as wiwb
+import functions.wiwb_scheduler as wiwb_scheduler
+from functions.wiwb_local import LocalGridDownloader
+
+EXTENT = [100000, 500000, 103500, 502500]
+POINTS = {"a": Point(101500, 501500), "b": Point(102500, 500500)}
+
+
+@pytest.fixture(autouse=True)
+def downloader(monkeypatch):
+    """Offline downloader without latency, failures or nodata."""
+    monkeypatch.setattr(LocalGridDownloader, "latency", 0.005)
+    monkeypatch.setattr(LocalGridDownloader, "failure_rate", 0.0)
+    monkeypatch.setattr(LocalGridDownloader, "nodata_rate", 0.0)
+    LocalGridDownloader.reset()
+    yield LocalGridDownloader
+    LocalGridDownloader.reset()
+
+
+def download_job(job):
+    return wiwb.download_wiwb(
+        data_source=job.data_source,
+        points=POINTS,
+        start=job.start,
+        end=job.end,
+        extent=EXTENT,
+        downloader_cls=LocalGridDownloader,
+    )
+
+
+def make_jobs(n):
+    start = datetime(2022, 1, 1)
+    return [
+        wiwb_scheduler.DownloadJob("HHNK", "irc_final", start + timedelta(days=i), start + timedelta(days=i + 1))
+        for i in range(n)
+    ]
+
+
+def make_scheduler(**kwargs):
+    kwargs = {"max_workers": 8, "max_per_host": 2, "max_retries": 2, "backoff": 0, "verbose": False, **kwargs}
+    return wiwb_scheduler.DownloadScheduler(download_job, no_data=(wiwb.NoDataError,), **kwargs)
+
+
+def test_download_jobs(downloader):
+    jobs = make_scheduler().run(make_jobs(4))
+
+    assert [job.status for job in jobs] == ["done"] * 4
+    assert all(job.attempts == 1 for job in jobs)
+    assert all(len(job.result) == 24 * len(POINTS) for job in jobs)
+    assert downloader.calls == 4
+
+
+def test_max_per_host(downloader):
+    make_scheduler(max_workers=8, max_per_host=2).run(make_jobs(16))
+
+    assert downloader.calls == 16
+    assert 1 <= downloader.max_active <= 2
+
+
+def test_failed_job_after_retries(downloader):
+    downloader.failure_rate = 1.0
+    scheduler = make_scheduler(max_retries=2)
+    jobs = scheduler.run(make_jobs(3))
+
+    assert [job.status for job in jobs] == ["failed"] * 3
+    assert all(job.attempts == 3 for job in jobs)
+    assert downloader.calls == downloader.failures == 9
+
+    report = scheduler.failure_report(jobs)
+    assert len(report) == 3
+    assert (report["attempts"] == 3).all()
+    assert report["error"].str.startswith("ConnectionError").all()
+
+
+def test_no_retry(downloader):
+    downloader.failure_rate = 1.0
+    jobs = make_scheduler(no_retry=(ConnectionError,)).run(make_jobs(2))
+
+    assert [job.status for job in jobs] == ["failed"] * 2
+    assert all(job.attempts == 1 for job in jobs)
+
+
+def test_no_data_is_empty(downloader):
+    downloader.nodata_rate = 1.0
+    scheduler = make_scheduler()
+    jobs = scheduler.run(make_jobs(2))
+
+    assert [job.status for job in jobs] == ["empty"] * 2
+    assert all(job.attempts == 1 and job.error is None for job in jobs)
+    assert downloader.calls == 2
+    assert scheduler.failure_report(jobs).empty